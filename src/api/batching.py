@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from .inference_worker import QueueFullError
+
+
+class BatchedRequest:
+    """A request waiting in a ``MicroBatcher`` window; await it for its own result."""
+
+    def __init__(self, item, loop):
+        self.item = item
+        self.future = loop.create_future()
+        self.arrived_at = time.perf_counter()
+        self.dispatched_at = None
+        self.job = None
+
+    @property
+    def batch_delay(self):
+        """Seconds spent waiting for the batch window to close."""
+        end = self.dispatched_at if self.dispatched_at is not None else time.perf_counter()
+        return end - self.arrived_at
+
+    @property
+    def queue_wait(self):
+        """Total delay added before generation started: batch window plus worker queue."""
+        worker_wait = self.job.queue_wait if self.job is not None else 0.0
+        return self.batch_delay + worker_wait
+
+    def __await__(self):
+        return self.future.__await__()
+
+
+class MicroBatcher:
+    """Groups concurrent requests into one call of ``batch_fn`` on an ``InferenceWorker``.
+
+    A window opens with the first pending request and closes after ``max_wait_ms``
+    or as soon as ``max_batch_size`` requests have arrived, whichever comes first.
+    ``batch_fn`` receives the list of submitted items and must return one result
+    per item, in order.
+    """
+
+    def __init__(self, worker, batch_fn, max_batch_size=4, max_wait_ms=10.0):
+        self.worker = worker
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+        self.batches = 0
+        self.requests = 0
+        self.flushed_full = 0
+        self.flushed_timeout = 0
+        self.cancelled = 0
+        self.total_batch_delay = 0.0
+        self.max_batch_delay = 0.0
+        self.total_queue_wait = 0.0
+
+    def submit(self, *item):
+        """Add ``item`` to the current window; must be called from the event loop."""
+        loop = asyncio.get_running_loop()
+        request = BatchedRequest(item, loop)
+        self._pending.append(request)
+        if len(self._pending) >= self.max_batch_size:
+            self._flush("full")
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush, "timeout")
+        return request
+
+    def _flush(self, reason):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # clients that disconnected while waiting cancelled their futures; don't run them
+        live = [request for request in self._pending if not request.future.done()]
+        self.cancelled += len(self._pending) - len(live)
+        self._pending = live
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        if self._pending:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.max_wait, self._flush, "timeout")
+        if not batch:
+            return
+
+        now = time.perf_counter()
+        for request in batch:
+            request.dispatched_at = now
+            self.total_batch_delay += request.batch_delay
+            self.max_batch_delay = max(self.max_batch_delay, request.batch_delay)
+        self.batches += 1
+        self.requests += len(batch)
+        if reason == "full":
+            self.flushed_full += 1
+        else:
+            self.flushed_timeout += 1
+
+        try:
+            job = self.worker.submit(self.batch_fn, [request.item for request in batch])
+        except QueueFullError as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        for request in batch:
+            request.job = job
+
+        task = asyncio.ensure_future(self._deliver(job, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, job, batch):
+        try:
+            results = await job
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        self.total_queue_wait += sum(request.queue_wait for request in batch)
+        for request, result in zip(batch, results):
+            if not request.future.done():
+                request.future.set_result(result)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "batch_fill_rate": self.requests / (self.batches * self.max_batch_size) if self.batches else 0.0,
+            "flushed_full": self.flushed_full,
+            "flushed_timeout": self.flushed_timeout,
+            "cancelled": self.cancelled,
+            "avg_batch_delay_s": self.total_batch_delay / self.requests if self.requests else 0.0,
+            "max_batch_delay_s": self.max_batch_delay,
+            "avg_queue_wait_s": self.total_queue_wait / self.requests if self.requests else 0.0,
+        }
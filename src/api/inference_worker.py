@@ -0,0 +1,149 @@
+import asyncio
+import queue
+import threading
+import time
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the worker queue is at its configured depth."""
+
+
+class InferenceJob:
+    """A unit of work queued on an ``InferenceWorker``; await it for the result."""
+
+    def __init__(self, fn, args, kwargs, loop):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.loop = loop
+        self.future = loop.create_future()
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def queue_wait(self):
+        """Seconds spent in the queue before the worker picked the job up."""
+        if self.started_at is None:
+            return time.perf_counter() - self.enqueued_at
+        return self.started_at - self.enqueued_at
+
+    @property
+    def run_time(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def __await__(self):
+        return self.future.__await__()
+
+
+def _resolve(future, result=None, error=None):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class InferenceWorker:
+    """Owns a blocking model on one dedicated thread, fed by a bounded queue.
+
+    ``submit`` is called from the event loop and returns immediately with an
+    ``InferenceJob``; the model call runs on the worker thread and the result is
+    handed back to the loop thread-safely, so the loop never blocks on generation.
+    """
+
+    def __init__(self, name="inference-worker", max_queue_size=32):
+        self.name = name
+        self.max_queue_size = max_queue_size
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.last_queue_wait = 0.0
+        self.total_run_time = 0.0
+        self.busy = False
+
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` for the worker thread; must be called from a running loop."""
+        if self._stopped:
+            raise RuntimeError(f"{self.name} is stopped")
+        job = InferenceJob(fn, args, kwargs, asyncio.get_running_loop())
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError(
+                f"{self.name} queue is full ({self.max_queue_size} pending requests)"
+            )
+        return job
+
+    def _loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            if job.future.cancelled():
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        job.started_at = time.perf_counter()
+        self.busy = True
+        result, error = None, None
+        try:
+            result = job.fn(*job.args, **job.kwargs)
+        except BaseException as e:  # hand every failure back to the caller
+            error = e
+        finally:
+            job.finished_at = time.perf_counter()
+            self.busy = False
+
+        with self._lock:
+            wait = job.queue_wait
+            self.last_queue_wait = wait
+            self.total_queue_wait += wait
+            self.max_queue_wait = max(self.max_queue_wait, wait)
+            self.total_run_time += job.run_time
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+        job.loop.call_soon_threadsafe(_resolve, job.future, result, error)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                "busy": self.busy,
+                "queue_depth": self.queue_depth(),
+                "max_queue_size": self.max_queue_size,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_queue_wait_s": self.total_queue_wait / done if done else 0.0,
+                "max_queue_wait_s": self.max_queue_wait,
+                "last_queue_wait_s": self.last_queue_wait,
+                "avg_run_time_s": self.total_run_time / done if done else 0.0,
+            }
+
+    def close(self, timeout=None):
+        """Stop accepting work and let the thread exit once the queue drains."""
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join(timeout)
@@ -1,10 +1,28 @@
-from fastapi import FastAPI, HTTPException
+import time
+IMPORT_STARTED = time.perf_counter()  # startup phase timings are measured from here
+
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from PIL import Image
+from typing import Optional
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import io
+import gc
+import tempfile
+import os
 import base64
-from ..model.hf_model import ClaraPipeline
-from ..model.api_model import GeminiMedicalPipeline, ChatGPTMedicalVisionPipeline
+from ..model.api_model import GeminiMedicalPipeline, ChatGPTMedicalVisionPipeline, close_http_client
+from ..model.resolution import PROFILES, get_policy
+from ..model import compile_cache
+from .inference_worker import InferenceWorker, QueueFullError
+from .batching import MicroBatcher
+from .response_cache import ResponseCache, image_digest, make_key
+from .singleflight import SingleFlight
+from .streaming import StreamStats, drain, prepend, sse
+from .stage_timings import StageTimings, server_timing
+from .model_registry import ModelRegistry, ModelUnavailable
 
 app = FastAPI()
 
@@ -13,52 +31,680 @@ class PredictionRequest(BaseModel):
     images: str  # Base64 encoded image
     text: str
     model_name: str
+    resolution: Optional[str] = None  # "fast", "default" or "detail"; per-model default if unset
 
 class PredictionResponse(BaseModel):
     outputs: str
-# init clara model 
-model_path = '/home/truongnn/chaos/code/repo/medical_inferneces/model_hf_cached' # FIXME
 
-clara_model = ClaraPipeline(model_path)
-# clara_model = None
-gemini_pipeline = GeminiMedicalPipeline()
-chat_gpt_pipeline = ChatGPTMedicalVisionPipeline()
+class PredictAllRequest(BaseModel):
+    images: str  # Base64 encoded image
+    text: str
+    model_names: Optional[list[str]] = None  # defaults to every model
+    resolution: Optional[str] = None
+
+MODEL_NAMES = ("clara", "gemini", "gpt")
+# init clara model
+model_path = os.getenv("CLARA_MODEL_PATH", '/home/truongnn/chaos/code/repo/medical_inferneces/model_hf_cached') # FIXME
+CLARA_MAX_TOKENS = 512
+CLARA_MAX_SEQ_LENGTH = 1024
+GEMINI_MODEL = "gemini-2.0-flash"
+GPT_MODEL = "openai/o4-mini"
+COMPILE_CACHE_DIR = os.getenv("COMPILE_CACHE_DIR", compile_cache.DEFAULT_CACHE_DIR)
+
+# Clara generation runs on its own thread so the event loop keeps serving other requests
+clara_worker = InferenceWorker(name="clara-worker", max_queue_size=int(os.getenv("CLARA_MAX_QUEUE", "32")))
+
+
+def run_clara_batch(items):
+    images, texts = zip(*items)
+    return registry.loaded("clara").pipeline.run_batch(list(images), list(texts))
+
+
+# concurrent Clara requests are grouped into one batched generate on the worker
+clara_batcher = MicroBatcher(
+    clara_worker,
+    run_clara_batch,
+    max_batch_size=int(os.getenv("CLARA_MAX_BATCH_SIZE", "4")),
+    max_wait_ms=float(os.getenv("CLARA_BATCH_WAIT_MS", "10")),
+)
+
+# "batch" groups whole requests, "continuous" schedules sequences per decode step
+CLARA_BACKEND = os.getenv("CLARA_BACKEND", "batch").lower()
+
+
+class ClaraService:
+    """Clara pipeline plus the scheduler feeding it; the unit the model registry loads and unloads."""
+
+    def __init__(self):
+        # compiled graphs from earlier runs are reused; the cache location must be set before torch loads
+        compile_cache.configure(COMPILE_CACHE_DIR)
+        # imported here so unsloth/torch start-up cost is part of loading Clara, not of importing the app
+        from ..model.hf_model import ClaraPipeline
+        from ..model.continuous_batching import ContinuousClaraBackend
+
+        self.artifacts_loaded = compile_cache.load_artifacts(COMPILE_CACHE_DIR)
+
+        self.pipeline = ClaraPipeline(
+            model_path,
+            max_seq_length=CLARA_MAX_SEQ_LENGTH,
+            max_tokens=CLARA_MAX_TOKENS,
+            vision_cache_bytes=int(float(os.getenv("CLARA_VISION_CACHE_MB", "256")) * 1024 * 1024),
+            vision_cache_dir=os.getenv("CLARA_VISION_CACHE_DIR") or None,
+        )
+        if CLARA_BACKEND == "continuous":
+            self.backend = ContinuousClaraBackend(self.pipeline, max_slots=int(os.getenv("CLARA_MAX_SLOTS", "8")))
+        else:
+            self.backend = clara_batcher
+
+    def warm_up(self):
+        """Compile every expected shape bucket before Clara takes requests, then persist the artifacts."""
+        if os.getenv("CLARA_WARMUP", "1") == "0":
+            return None
+        profiles = os.getenv("CLARA_WARMUP_PROFILES") or MODEL_RESOLUTION["clara"]
+        profiles = list(PROFILES) if profiles == "all" else profiles.split(",")
+        batch_sizes = [1] if CLARA_BACKEND == "continuous" else [1, clara_batcher.max_batch_size]
+        report = compile_cache.warm_up(self.pipeline, profiles, batch_sizes)
+        report["artifacts_loaded"] = self.artifacts_loaded
+        report["artifacts_saved_bytes"] = compile_cache.save_artifacts(COMPILE_CACHE_DIR)
+        return report
+
+    def close(self):
+        if self.backend is not clara_batcher:
+            self.backend.close(timeout=5)
+        self.pipeline = self.backend = None
+        gc.collect()
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def memory_pressure():
+    """True when free GPU memory is below ``MODEL_UNLOAD_FREE_FRACTION`` of the total.
+
+    A fraction of ``1`` or more always reports pressure, so idleness alone unloads;
+    otherwise there is none without CUDA, since no GPU memory can be freed.
+    """
+    import torch
+    free_fraction = float(os.getenv("MODEL_UNLOAD_FREE_FRACTION", "0.2"))
+    if free_fraction >= 1:
+        return True
+    if not torch.cuda.is_available():
+        return False
+    free, total = torch.cuda.mem_get_info()
+    return free / total < free_fraction
+
+
+# backends are built on first use or at startup preload; a missing API key only disables its backend
+registry = ModelRegistry()
+registry.register("clara", ClaraService, local=True, warmup=ClaraService.warm_up, unload=ClaraService.close)
+registry.register("gemini", lambda: GeminiMedicalPipeline(GEMINI_MODEL))
+registry.register("gpt", lambda: ChatGPTMedicalVisionPipeline(GPT_MODEL))
+
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "all").lower()
+PRELOAD_MODELS = (
+    list(MODEL_NAMES) if PRELOAD_MODELS == "all"
+    else [] if PRELOAD_MODELS in ("", "none")
+    else [name.strip() for name in PRELOAD_MODELS.split(",")]
+)
+startup_timings = {}
+background_tasks = []
+
+# identical image + question + model + settings are answered from cache
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "512")),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    sqlite_path=os.getenv("RESPONSE_CACHE_DB") or None,
+)
+in_flight = SingleFlight()
+stream_stats = StreamStats()
+
+# uploaded images above this size are refused with 413; raw bodies spill to disk past the spool size
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+UPLOAD_SPOOL_BYTES = 1024 * 1024
+
+# image decode, resize and Clara's patch extraction run here, overlapping with generation
+preprocess_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PREPROCESS_WORKERS", "4")), thread_name_prefix="preprocess"
+)
+stage_timings = StageTimings()
+
+# visual-token budget per model unless the request picks a profile
+MODEL_RESOLUTION = {
+    "clara": os.getenv("CLARA_RESOLUTION", "default"),
+    "gemini": os.getenv("GEMINI_RESOLUTION", "default"),
+    "gpt": os.getenv("GPT_RESOLUTION", "default"),
+}
+
+
+def generation_params(model_name):
+    """Settings that change a model's output; part of the response cache key."""
+    model_name = model_name.lower()
+    if model_name == 'clara':
+        # the continuous backend decodes greedily, the batch backend follows generation_config
+        return {"max_tokens": CLARA_MAX_TOKENS, "max_seq_length": CLARA_MAX_SEQ_LENGTH, "backend": CLARA_BACKEND}
+    elif model_name == 'gemini':
+        return {"model": f"models/{GEMINI_MODEL}"}
+    elif model_name == 'gpt':
+        return {"model": GPT_MODEL, "max_tokens": 1024}
+    return {}
+
+
+def record_stage(timings, stage, seconds):
+    timings[stage] = timings.get(stage, 0.0) + seconds
+    stage_timings.record(stage, seconds)
+
+
+async def in_pool(stage, timings, fn, *args):
+    """Run CPU-bound preprocessing on the pool, timing it as ``stage``."""
+    started = time.perf_counter()
+    result = await asyncio.get_running_loop().run_in_executor(preprocess_pool, fn, *args)
+    record_stage(timings, stage, time.perf_counter() - started)
+    return result
+
+
+async def run_model(model_name, image, text, timings):
+    """Run one backend; returns the output and extra response headers."""
+    if model_name.lower() == 'clara':
+        clara = await registry.use("clara")
+        try:
+            # Clara's image processor runs ahead on the pool, overlapping with generation
+            prepared = await in_pool("patchify", timings, clara.pipeline.preprocess_image, image)
+            started = time.perf_counter()
+            pending = clara.backend.submit(prepared, text)
+            response = await pending
+        finally:
+            registry.release("clara")
+        record_stage(timings, "queue", pending.queue_wait)
+        record_stage(timings, "generate", time.perf_counter() - started - pending.queue_wait)
+        return response, {"X-Queue-Wait": f"{pending.queue_wait:.4f}"}
+
+    elif model_name.lower() in ('gemini', 'gpt'):
+        pipeline = await registry.get(model_name)
+        started = time.perf_counter()
+        response = await pipeline.run_async(image, text)
+        record_stage(timings, "generate", time.perf_counter() - started)
+        return response, {}
+
+    # Add other model types here
+    # elif isinstance(model, OtherModel):
+    #     response = model.different_predict_method(image, request.text)
+    else:
+        raise ValueError(f"Unsupported model type: {model_name}")
+
+
+def wants_refresh(x_cache_bypass, cache_control):
+    if x_cache_bypass and x_cache_bypass.lower() not in ("0", "false", "no"):
+        return True
+    return bool(cache_control) and "no-cache" in cache_control.lower()
+
+
+def as_http_error(e):
+    """The HTTPException a failed request answers with: 503 when the backend is unavailable or its queue is full."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, (QueueFullError, ModelUnavailable)):
+        return HTTPException(status_code=503, detail=str(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+
+def resolve_policy(model_name, resolution=None):
+    """Resolution profile for a request; unknown profile names are a 400."""
+    try:
+        return get_policy(resolution or MODEL_RESOLUTION.get(model_name.lower()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def load_image(fp, policy):
+    """Decode to RGB at full size; the policy's resize happens per model in ``predict_one``."""
+    image = Image.open(fp)
+    if image.format == "JPEG":
+        # let libjpeg decode at a reduced scale, never below the size the policy needs
+        image.draft("RGB", policy.target_size(*image.size))
+    return image.convert("RGB")
+
+
+def decode_base64_image(data, policy):
+    return load_image(io.BytesIO(base64.b64decode(data)), policy)
+
+
+def upload_too_large(size):
+    return HTTPException(
+        status_code=413, detail=f"Image of {size} bytes exceeds the {MAX_UPLOAD_BYTES} byte upload limit"
+    )
+
+
+async def read_image_body(request):
+    """Read a multipart or raw-image request body into ``(file, form)``; ``form`` is ``{}`` for raw bodies.
+
+    Bodies above ``MAX_UPLOAD_BYTES`` are rejected with 413; raw bodies are spooled
+    like multipart uploads, in memory up to ``UPLOAD_SPOOL_BYTES`` and on disk beyond.
+    """
+    content_type = request.headers.get("content-type", "")
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > MAX_UPLOAD_BYTES:
+        raise upload_too_large(int(length))
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("image")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="multipart body needs an 'image' file field")
+        if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+            raise upload_too_large(upload.size)
+        # the spooled upload file is read by PIL in place
+        return upload.file, form
+    elif content_type.startswith("image/") or content_type.startswith("application/octet-stream"):
+        body = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                body.close()
+                raise upload_too_large(size)
+            # once rolled over to disk, writes leave the event loop
+            if getattr(body, "_rolled", True):
+                await asyncio.to_thread(body.write, chunk)
+            else:
+                body.write(chunk)
+        body.seek(0)
+        return body, {}
+    raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type or 'none'}")
+
+
+async def read_upload(request, timings, text=None, model_name=None, resolution=None):
+    """Decode a multipart or raw-image request body into ``(image, text, model_name, policy)``."""
+    fp, form = await read_image_body(request)
+    text = form.get("text", text)
+    model_name = form.get("model_name", model_name)
+    if text is None or model_name is None:
+        raise HTTPException(status_code=400, detail="'text' and 'model_name' are required")
+    policy = resolve_policy(model_name, form.get("resolution", resolution))
+    image = await in_pool("decode", timings, load_image, fp, policy)
+    return image, text, model_name, policy
+
+
+async def predict_one(image, text, model_name, refresh, timings, policy):
+    """Response cache, coalescing and model call for one model; returns the output and response headers.
+
+    The image is first resized by ``policy``; stage durations are added to ``timings``.
+    """
+    image = await in_pool("resize", timings, policy.apply, image)
+    key = make_key(image_digest(image), text, model_name, generation_params(model_name))
+    if refresh:
+        response_cache.record_bypass()
+        cache_status = "BYPASS"
+    else:
+        cached = await response_cache.aget(key)
+        if cached is not None:
+            return cached, {"X-Cache": "HIT"}
+        cache_status = "MISS"
+
+    async def compute():
+        started = time.perf_counter()
+        outputs = await run_model(model_name, image, text, timings)
+        response_cache.put(key, outputs[0], time.perf_counter() - started)
+        return outputs
 
+    # identical requests already running share that computation
+    (response, headers), shared = await in_flight.do(key, compute)
+    headers = {"X-Cache": cache_status, **headers}
+    if shared:
+        headers["X-Coalesced"] = "1"
+    return response, headers
+
+
+async def answer(image, text, model_name, http_response, refresh, timings, policy):
+    """Shared tail of the /predict endpoints."""
+    response, headers = await predict_one(image, text, model_name, refresh, timings, policy)
+    http_response.headers.update(headers)
+    http_response.headers["Server-Timing"] = server_timing(timings)
+    return PredictionResponse(outputs=response)
+
+
+async def start_stream(model_name, image, text, emit, timings):
+    """Start a generation that reports ``(kind, payload)`` events to ``emit``; returns its task."""
+    if model_name.lower() == 'clara':
+        clara = await registry.use("clara")
+        try:
+            prepared = await in_pool("patchify", timings, clara.pipeline.preprocess_image, image)
+            # streamed requests skip micro-batching: the batched generate has no per-request streamer
+            if CLARA_BACKEND == "continuous":
+                pending = clara.backend.submit(prepared, text, on_event=emit)
+            else:
+                pending = clara_worker.submit(clara.pipeline.run, prepared, text, on_event=emit)
+        except BaseException:
+            registry.release("clara")
+            raise
+        task = asyncio.ensure_future(pending)
+        task.add_done_callback(lambda _: registry.release("clara"))
+        return task
+
+    elif model_name.lower() in ('gemini', 'gpt'):
+        pipeline = await registry.get(model_name)
+        return asyncio.ensure_future(asyncio.to_thread(drain, pipeline.stream(image, text), emit))
+
+    else:
+        raise ValueError(f"Unsupported model type: {model_name}")
+
+
+async def stream_answer(image, text, model_name, refresh, timings, policy):
+    """Server-sent events for one prediction: start, section/token..., then done or error.
+
+    The first event is only yielded once the answer is cached or its generation
+    has started, so an unavailable backend or a full queue raises from the first
+    ``__anext__`` instead of ending an open stream; any other failure is an ``error`` event.
+    """
+    started = time.perf_counter()
+    start = sse("start", {"model_name": model_name, "resolution": policy.name})
+
+    try:
+        image = await in_pool("resize", timings, policy.apply, image)
+        key = make_key(image_digest(image), text, model_name, generation_params(model_name))
+        cached = None
+        if refresh:
+            response_cache.record_bypass()
+        else:
+            cached = await response_cache.aget(key)
+    except Exception as e:
+        yield start
+        yield sse("error", {"detail": str(e)})
+        return
+    if cached is not None:
+        yield start
+        yield sse("token", {"text": cached})
+        yield sse("done", {
+            "cached": True, "ttft_s": 0.0, "total_s": time.perf_counter() - started, "tokens": 0, "timings": timings,
+        })
+        return
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(kind, payload):
+        # called from worker threads as well as the loop itself
+        loop.call_soon_threadsafe(events.put_nowait, (kind, payload))
+
+    try:
+        task = await start_stream(model_name, image, text, emit, timings)
+    except (QueueFullError, ModelUnavailable):
+        raise
+    except Exception as e:
+        yield start
+        yield sse("error", {"detail": str(e)})
+        return
+    yield start
+    generate_started = time.perf_counter()
+    task.add_done_callback(lambda _: loop.call_soon_threadsafe(events.put_nowait, None))
+
+    ttft, tokens = None, 0
+    while (event := await events.get()) is not None:
+        kind, payload = event
+        if kind == "tokens":
+            tokens += payload
+        elif kind == "section":
+            yield sse("section", {"text": payload})
+        elif kind == "text":
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            yield sse("token", {"text": payload})
+
+    total = time.perf_counter() - started
+    if task.exception() is not None:
+        yield sse("error", {"detail": str(task.exception())})
+        return
+    record_stage(timings, "generate", time.perf_counter() - generate_started)
+    response_cache.put(key, task.result(), total)
+    stream_stats.record(model_name.lower(), ttft, total, tokens)
+    yield sse("done", {"cached": False, "ttft_s": ttft, "total_s": total, "tokens": tokens, "timings": timings})
+
+
+async def stream_all(image, text, policies, refresh, timings):
+    """Server-sent ``result``/``error`` events, one per model in completion order, then ``done``."""
+    started = time.perf_counter()
+
+    async def timed(model_name):
+        model_timings = dict(timings)  # the shared decode plus this model's own stages
+        try:
+            response, headers = await predict_one(
+                image, text, model_name, refresh, model_timings, policies[model_name]
+            )
+        except Exception as e:
+            return model_name, None, e
+        return model_name, (response, headers, time.perf_counter() - started, model_timings), None
+
+    yield sse("start", {"model_names": list(policies)})
+    for next_done in asyncio.as_completed([timed(model_name) for model_name in policies]):
+        model_name, result, error = await next_done
+        if error is not None:
+            # the status /predict would have answered this model with
+            status = as_http_error(error).status_code
+            yield sse("error", {"model_name": model_name, "status": status, "detail": str(error)})
+            continue
+        response, headers, latency, model_timings = result
+        yield sse("result", {
+            "model_name": model_name,
+            "outputs": response,
+            "latency_s": latency,
+            "cached": headers.get("X-Cache") == "HIT",
+            "timings": model_timings,
+        })
+    yield sse("done", {"total_s": time.perf_counter() - started})
 
 
 @app.post("/predict", response_model=PredictionResponse)
-async def predict(request: PredictionRequest):
-    global clara_model
+async def predict(
+    request: PredictionRequest,
+    http_response: Response,
+    x_cache_bypass: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None),
+):
     try:
         # Decode base64 image
-        image_bytes = base64.b64decode(request.images)
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB").resize((448, 448))
-        
-    
-        
-        if request.model_name.lower() == 'clara':
-            response = clara_model.run(image, request.text)
-            return PredictionResponse(outputs=response)
-        
-        elif request.model_name.lower() == 'gemini':
-            response = gemini_pipeline.run(image, request.text)
-            return PredictionResponse(outputs=response)
-        
-        elif request.model_name.lower() == 'gpt':
-            response = chat_gpt_pipeline.run(image, request.text)
-            return PredictionResponse(outputs=response)
-            
-
-        # Add other model types here
-        # elif isinstance(model, OtherModel):
-        #     response = model.different_predict_method(image, request.text)
+        timings = {}
+        policy = resolve_policy(request.model_name, request.resolution)
+        image = await in_pool("decode", timings, decode_base64_image, request.images, policy)
+
+        return await answer(
+            image, request.text, request.model_name, http_response,
+            wants_refresh(x_cache_bypass, cache_control), timings, policy,
+        )
+
+    except Exception as e:
+        raise as_http_error(e)
+
+
+@app.post("/predict/upload", response_model=PredictionResponse)
+async def predict_upload(
+    request: Request,
+    http_response: Response,
+    text: Optional[str] = None,
+    model_name: Optional[str] = None,
+    resolution: Optional[str] = None,
+    x_cache_bypass: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None),
+):
+    """Binary variant of /predict.
+
+    Accepts ``multipart/form-data`` with an ``image`` file and ``text``/``model_name``
+    fields, or a raw ``image/*`` (or ``application/octet-stream``) body with
+    ``text`` and ``model_name`` as query parameters. The image is decoded straight
+    from the upload instead of going through a base64 string.
+    """
+    try:
+        timings = {}
+        image, text, model_name, policy = await read_upload(request, timings, text, model_name, resolution)
+        return await answer(
+            image, text, model_name, http_response, wants_refresh(x_cache_bypass, cache_control), timings, policy,
+        )
+
+    except Exception as e:
+        raise as_http_error(e)
+
+
+@app.post("/predict/stream")
+async def predict_stream(
+    request: Request,
+    text: Optional[str] = None,
+    model_name: Optional[str] = None,
+    resolution: Optional[str] = None,
+    x_cache_bypass: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None),
+):
+    """Streaming variant of /predict, as ``text/event-stream``.
+
+    Takes the /predict JSON body or any body /predict/upload accepts. Emits a
+    ``start`` event, ``section`` and ``token`` events as text is generated, and a
+    final ``done`` event with ``ttft_s``, ``total_s``, ``tokens`` and per-stage
+    ``timings`` (or ``error``). Failures before the stream opens get the status
+    /predict would answer with, 503 when the backend is unavailable or busy.
+    """
+    timings = {}
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            try:
+                body = PredictionRequest(**await request.json())
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            policy = resolve_policy(body.model_name, body.resolution)
+            image = await in_pool("decode", timings, decode_base64_image, body.images, policy)
+            text, model_name = body.text, body.model_name
+        else:
+            image, text, model_name, policy = await read_upload(request, timings, text, model_name, resolution)
+
+        events = stream_answer(image, text, model_name, wants_refresh(x_cache_bypass, cache_control), timings, policy)
+        first = await events.__anext__()
+    except Exception as e:
+        raise as_http_error(e)
+
+    return StreamingResponse(
+        prepend(first, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/predict_all")
+async def predict_all(
+    request: Request,
+    text: Optional[str] = None,
+    model_names: Optional[str] = None,
+    resolution: Optional[str] = None,
+    x_cache_bypass: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None),
+):
+    """Ask several models about one image; each answer is streamed back as soon as it is ready.
+
+    Takes a JSON body like /predict with an optional ``model_names`` list, or any
+    /predict/upload body with ``model_names`` as a comma-separated field. The image
+    is decoded once and the models run concurrently. The response is
+    ``text/event-stream``: ``start``, then one ``result`` (or ``error``) event per
+    model in completion order, then ``done``. Failures before the stream opens get
+    the status /predict would answer with; a model's ``error`` event carries the
+    ``status`` /predict would have answered it with.
+    """
+    timings = {}
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            try:
+                body = PredictAllRequest(**await request.json())
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            decode, source = decode_base64_image, body.images
+            text, names, resolution = body.text, body.model_names, body.resolution
         else:
-            raise ValueError(f"Unsupported model type: {type(request.model_name)}")
-        
-        
+            decode = load_image
+            source, form = await read_image_body(request)
+            text = form.get("text", text)
+            names = form.get("model_names", model_names)
+            names = names.split(",") if names else None
+            resolution = form.get("resolution", resolution)
+            if text is None:
+                raise HTTPException(status_code=400, detail="'text' is required")
+
+        names = [name.strip().lower() for name in names] if names else list(MODEL_NAMES)
+        unknown = [name for name in names if name not in MODEL_NAMES]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unsupported model type: {', '.join(unknown)}")
+
+        policies = {name: resolve_policy(name, resolution) for name in names}
+        # decode once, large enough for the most detailed profile among the models
+        image = await in_pool(
+            "decode", timings, decode, source, max(policies.values(), key=lambda policy: policy.max_pixels)
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise as_http_error(e)
+
+    return StreamingResponse(
+        stream_all(image, text, policies, wants_refresh(x_cache_bypass, cache_control), timings),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "clara_queue_depth": clara_worker.queue_depth()}
+
+
+@app.get("/ready")
+async def ready(http_response: Response):
+    """Readiness of each backend; 503 until every preloaded backend is loaded and warmed up."""
+    models = registry.readiness()
+    is_ready = all(models[name]["ready"] for name in PRELOAD_MODELS if name in models)
+    if not is_ready:
+        http_response.status_code = 503
+    return {"ready": is_ready, "preload": PRELOAD_MODELS, "models": models, "startup": startup_timings}
+
+
+@app.get("/metrics")
+async def metrics():
+    metrics = {
+        "clara_worker": clara_worker.stats(),
+        "clara_batcher": clara_batcher.stats(),
+        "response_cache": response_cache.stats(),
+        "in_flight": in_flight.stats(),
+        "streaming": stream_stats.stats(),
+        "stages": stage_timings.stats(),
+        "models": registry.readiness(),
+    }
+    clara = registry.loaded("clara")
+    if clara is not None and CLARA_BACKEND == "continuous":
+        metrics["clara_continuous"] = clara.backend.stats()
+    if clara is not None and clara.pipeline.vision_cache is not None:
+        metrics["clara_vision_cache"] = clara.pipeline.vision_cache.stats()
+    if clara is not None:
+        metrics["clara_rope_tables"] = clara.pipeline.rope_tables.stats()
+        metrics["clara_rope_index"] = clara.pipeline.rope_index_cache.stats()
+    return metrics
+
+
+@app.on_event("startup")
+async def startup():
+    startup_timings["import_s"] = time.perf_counter() - IMPORT_STARTED
+    started = time.perf_counter()
+
+    async def preload():
+        await registry.preload(PRELOAD_MODELS)
+        startup_timings["preload_s"] = time.perf_counter() - started
+        startup_timings["ready_s"] = time.perf_counter() - IMPORT_STARTED
+
+    # the server accepts requests while models load; /ready reports when they are done
+    background_tasks.append(asyncio.create_task(preload()))
+    idle_unload_s = float(os.getenv("MODEL_IDLE_UNLOAD_S", "0"))
+    if idle_unload_s > 0:
+        background_tasks.append(asyncio.create_task(registry.reap_idle(idle_unload_s, memory_pressure)))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    clara_worker.close(timeout=5)
+    registry.close()
+    response_cache.close(timeout=5)
+    await close_http_client()
+    preprocess_pool.shutdown(wait=False)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8314)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8314)
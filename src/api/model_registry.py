@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ModelUnavailable(RuntimeError):
+    """A backend failed to load (e.g. a missing API key) or is not registered."""
+
+
+class ModelEntry:
+    def __init__(self, name, factory, local=False, warmup=None, unload=None):
+        self.name = name
+        self.factory = factory
+        self.local = local
+        self.warmup = warmup
+        self.unload_hook = unload
+        self.state = "unloaded"  # unloaded -> loading -> warming -> ready, or failed
+        self.instance = None
+        self.error = None
+        self.failed_at = None
+        self.load_s = None
+        self.warmup_s = None
+        self.warmup_report = None
+        self.loads = 0
+        self.active = 0
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def status(self):
+        return {
+            "state": self.state,
+            "ready": self.state == "ready",
+            "local": self.local,
+            "error": self.error,
+            "load_s": self.load_s,
+            "warmup_s": self.warmup_s,
+            "warmup": self.warmup_report,
+            "loads": self.loads,
+            "active": self.active,
+            "idle_s": time.monotonic() - self.last_used,
+        }
+
+
+class ModelRegistry:
+    """Backends built on first use (or at preload), warmed up, and unloaded when idle.
+
+    ``factory()`` and ``warmup(instance)`` are blocking and run on a thread; what
+    ``warmup`` returns is kept as the backend's warm-up report. A factory that
+    raises leaves the backend ``failed``; it is retried on use after ``retry_after``
+    seconds, so one broken backend never takes the server down.
+    """
+
+    def __init__(self, retry_after=30.0):
+        self.retry_after = retry_after
+        self._entries = {}
+
+    def register(self, name, factory, local=False, warmup=None, unload=None):
+        self._entries[name] = ModelEntry(name, factory, local=local, warmup=warmup, unload=unload)
+
+    def names(self):
+        return list(self._entries)
+
+    def _entry(self, name):
+        try:
+            return self._entries[name.lower()]
+        except KeyError:
+            raise ModelUnavailable(f"Unsupported model type: {name}")
+
+    def loaded(self, name):
+        """Instance if the backend is ready, else None; safe to call from any thread."""
+        entry = self._entry(name)
+        return entry.instance if entry.state == "ready" else None
+
+    async def get(self, name):
+        """Ready instance, loading and warming it up first if needed."""
+        entry = self._entry(name)
+        entry.last_used = time.monotonic()
+        if entry.state == "ready":
+            return entry.instance
+        async with entry.lock:
+            if entry.state == "ready":
+                return entry.instance
+            if entry.state == "failed" and time.monotonic() - entry.failed_at < self.retry_after:
+                raise ModelUnavailable(f"{entry.name} is unavailable: {entry.error}")
+            await self._load(entry)
+        return entry.instance
+
+    async def _load(self, entry):
+        instance = None
+        try:
+            entry.state, entry.error = "loading", None
+            started = time.perf_counter()
+            instance = await asyncio.to_thread(entry.factory)
+            entry.load_s = time.perf_counter() - started
+            if entry.warmup is not None:
+                entry.state = "warming"
+                started = time.perf_counter()
+                entry.warmup_report = await asyncio.to_thread(entry.warmup, instance)
+                entry.warmup_s = time.perf_counter() - started
+        except Exception as e:
+            logger.exception("loading %s failed", entry.name)
+            if instance is not None and entry.unload_hook is not None:
+                entry.unload_hook(instance)
+            entry.state, entry.error, entry.failed_at = "failed", f"{type(e).__name__}: {e}", time.monotonic()
+            raise ModelUnavailable(f"{entry.name} is unavailable: {entry.error}") from e
+        entry.instance, entry.state = instance, "ready"
+        entry.loads += 1
+        logger.info("%s ready (load %.1fs, warm-up %.1fs)", entry.name, entry.load_s, entry.warmup_s or 0.0)
+
+    def acquire(self, name):
+        """Mark a backend in use so the idle reaper leaves it alone; pair with ``release``."""
+        entry = self._entry(name)
+        entry.active += 1
+        entry.last_used = time.monotonic()
+
+    def release(self, name):
+        entry = self._entry(name)
+        entry.active -= 1
+        entry.last_used = time.monotonic()
+
+    async def use(self, name):
+        instance = await self.get(name)
+        self.acquire(name)
+        return instance
+
+    async def preload(self, names):
+        """Load backends concurrently; failures are recorded, not raised."""
+        await asyncio.gather(*(self.get(name) for name in names), return_exceptions=True)
+
+    async def unload(self, name):
+        entry = self._entry(name)
+        async with entry.lock:
+            if entry.state != "ready" or entry.active:
+                return False
+            instance, entry.instance, entry.state = entry.instance, None, "unloaded"
+            if entry.unload_hook is not None:
+                await asyncio.to_thread(entry.unload_hook, instance)
+        logger.info("%s unloaded after %.0fs idle", entry.name, time.monotonic() - entry.last_used)
+        return True
+
+    async def reap_idle(self, idle_seconds, under_pressure, interval=30.0):
+        """Background task: unload local backends idle for ``idle_seconds`` while ``under_pressure()``."""
+        while True:
+            await asyncio.sleep(interval)
+            for entry in self._entries.values():
+                idle = time.monotonic() - entry.last_used
+                if entry.local and entry.state == "ready" and not entry.active and idle >= idle_seconds:
+                    if under_pressure():
+                        await self.unload(entry.name)
+
+    def readiness(self):
+        return {name: entry.status() for name, entry in self._entries.items()}
+
+    def close(self):
+        for entry in self._entries.values():
+            if entry.instance is not None and entry.unload_hook is not None:
+                entry.unload_hook(entry.instance)
+            entry.instance, entry.state = None, "unloaded"
@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+def image_digest(image):
+    """Content hash of a decoded PIL image (mode, size and pixels)."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def make_key(digest, text, model_name, params):
+    payload = json.dumps(
+        [digest, normalize_text(text), model_name.lower(), params],
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-memory LRU with TTL for model outputs, optionally backed by SQLite.
+
+    Every entry remembers how long it took to compute, so hits can report the
+    latency they saved. With ``sqlite_path`` set, entries are also written to a
+    SQLite table and survive restarts; memory misses fall back to it.
+
+    ``_lock`` only guards the in-memory entries and counters. SQLite has its own
+    lock: lookups run there without holding ``_lock`` (on an executor thread via
+    ``aget``), and writes are queued to a writer thread that commits them in batches.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=3600.0, sqlite_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, latency REAL NOT NULL)"
+            )
+            self._db.commit()
+            self._writes = queue.Queue()
+            self._writer = threading.Thread(target=self._write_loop, name="response-cache-writer", daemon=True)
+            self._writer.start()
+
+        self.memory_hits = 0
+        self.sqlite_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.latency_saved = 0.0
+        self.write_errors = 0
+
+    def _expired(self, created):
+        return self.ttl is not None and self.ttl > 0 and time.time() - created > self.ttl
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created, latency = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    self.latency_saved += latency
+                    return value
+                del self._entries[key]
+        return None
+
+    def _load(self, key):
+        """Second half of a lookup after a memory miss: SQLite, then the hit/miss bookkeeping."""
+        row = None
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT value, created, latency FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+        with self._lock:
+            if row is not None and not self._expired(row[1]):
+                self._store(key, *row)
+                self.sqlite_hits += 1
+                self.latency_saved += row[2]
+                return row[0]
+            self.misses += 1
+            return None
+
+    def get(self, key):
+        value = self._get_memory(key)
+        return value if value is not None else self._load(key)
+
+    async def aget(self, key):
+        """``get`` for the event loop: memory hits return inline, the SQLite fallback runs on an executor thread."""
+        value = self._get_memory(key)
+        if value is not None:
+            return value
+        if self._db is None:
+            return self._load(key)
+        return await asyncio.get_running_loop().run_in_executor(None, self._load, key)
+
+    def put(self, key, value, latency):
+        created = time.time()
+        with self._lock:
+            self._store(key, value, created, latency)
+        if self._writes is not None:
+            self._writes.put((key, value, created, latency))
+
+    def _write_loop(self):
+        while (row := self._writes.get()) is not None:
+            rows = [row]
+            # whatever queued up meanwhile goes into the same commit
+            while True:
+                try:
+                    row = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if row is None:
+                    self._writes.put(None)
+                    break
+                rows.append(row)
+            try:
+                with self._db_lock:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO responses (key, value, created, latency) VALUES (?, ?, ?, ?)", rows
+                    )
+                    self._db.commit()
+            except sqlite3.Error:
+                # the entries stay cached in memory; only their persistence is lost
+                with self._lock:
+                    self.write_errors += len(rows)
+
+    def close(self, timeout=None):
+        """Flush queued SQLite writes and stop the writer thread."""
+        if self._writes is not None:
+            self._writes.put(None)
+            self._writer.join(timeout)
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def _store(self, key, value, created, latency):
+        self._entries[key] = (value, created, latency)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.sqlite_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "sqlite_hits": self.sqlite_hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "latency_saved_s": self.latency_saved,
+                "sqlite_write_errors": self.write_errors,
+            }
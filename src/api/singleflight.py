@@ -0,0 +1,47 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one running computation.
+
+    The first caller for a key starts the computation; callers arriving while it
+    is still running await the same task and receive the same result (or
+    exception). The task is shielded, so a disconnecting caller does not cancel
+    the work the others are waiting for.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """Run ``fn()`` (a coroutine function) once per in-flight ``key``.
+
+        Returns ``(result, shared)`` where ``shared`` is True for coalesced callers.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.started += 1
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved when every caller went away
+
+    def stats(self):
+        total = self.started + self.coalesced
+        return {
+            "in_flight": len(self._inflight),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / total if total else 0.0,
+        }
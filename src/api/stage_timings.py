@@ -0,0 +1,34 @@
+import threading
+
+
+def server_timing(timings):
+    """``Server-Timing`` header value for a ``{stage: seconds}`` dict."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+class StageTimings:
+    """Aggregated time spent per request stage (decode, patchify, queue, generate)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            entry = self._stages.setdefault(stage, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+            entry["count"] += 1
+            entry["total_s"] += seconds
+            entry["max_s"] = max(entry["max_s"], seconds)
+
+    def stats(self):
+        with self._lock:
+            total = sum(entry["total_s"] for entry in self._stages.values())
+            return {
+                stage: {
+                    "count": entry["count"],
+                    "avg_ms": entry["total_s"] / entry["count"] * 1000,
+                    "max_ms": entry["max_s"] * 1000,
+                    "share": entry["total_s"] / total if total else 0.0,
+                }
+                for stage, entry in self._stages.items()
+            }
@@ -0,0 +1,54 @@
+import json
+import threading
+
+
+def sse(event, data):
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def prepend(first, events):
+    """Yield ``first``, then the rest of ``events``: a stream whose first event was awaited up front."""
+    yield first
+    async for event in events:
+        yield event
+
+
+def drain(events, emit):
+    """Forward ``(kind, payload)`` events from a blocking generator; returns the joined text."""
+    parts = []
+    for kind, payload in events:
+        if kind == "text":
+            parts.append(payload)
+        emit(kind, payload)
+    return "".join(parts)
+
+
+class StreamStats:
+    """Time-to-first-token, total latency and token throughput per model."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def record(self, model_name, ttft, total, tokens):
+        with self._lock:
+            entry = self._models.setdefault(
+                model_name, {"streams": 0, "ttft_s": 0.0, "total_s": 0.0, "tokens": 0}
+            )
+            entry["streams"] += 1
+            entry["ttft_s"] += ttft or 0.0
+            entry["total_s"] += total
+            entry["tokens"] += tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                model_name: {
+                    "streams": entry["streams"],
+                    "avg_ttft_s": entry["ttft_s"] / entry["streams"],
+                    "avg_total_s": entry["total_s"] / entry["streams"],
+                    "tokens_per_s": entry["tokens"] / entry["total_s"] if entry["total_s"] else 0.0,
+                }
+                for model_name, entry in self._models.items()
+            }
@@ -0,0 +1,236 @@
+"""Offline Clara inference over a directory of images or a CSV/JSONL manifest.
+
+    python -m src.batch.batch_infer --model-path /path/to/model --input archive/ --output results.jsonl
+    python -m src.batch.batch_infer --model-path /path/to/model --input manifest.csv \
+        --output results.jsonl --parquet results.parquet --num-shards 2 --gpus 0,1
+
+A manifest has an ``image`` column (path, relative to the manifest) and optional
+``question`` and ``id`` columns. Results are appended to the JSONL output after
+every batch; rerunning the same command skips keys that already have a result.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+from PIL import Image
+
+from ..model import compile_cache
+from ..model.resolution import PROFILES, get_policy
+
+DEFAULT_QUESTION = "Ảnh X-quang này có gì bất thường?"
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff"}
+
+
+def load_image(path, policy):
+    # same preprocessing as the API server
+    image = Image.open(path)
+    if image.format == "JPEG":
+        image.draft("RGB", policy.target_size(*image.size))
+    return policy.apply(image.convert("RGB"))
+
+
+def read_manifest(source, question=DEFAULT_QUESTION):
+    """List of ``{"key", "image", "question"}`` records from a directory, CSV or JSONL file."""
+    source = Path(source)
+    if source.is_dir():
+        paths = sorted(p for p in source.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+        return [{"key": str(p.relative_to(source)), "image": str(p), "question": question} for p in paths]
+
+    if source.suffix.lower() == ".csv":
+        frame = pd.read_csv(source, dtype=str, keep_default_na=False)
+    elif source.suffix.lower() in (".jsonl", ".json"):
+        frame = pd.read_json(source, lines=True, dtype=False)
+    else:
+        raise ValueError(f"Unsupported manifest type: {source}")
+    if "image" not in frame.columns:
+        raise ValueError(f"Manifest {source} has no 'image' column")
+    frame = frame.fillna("")
+
+    records = []
+    for row in frame.to_dict("records"):
+        image = Path(row["image"])
+        if not image.is_absolute():
+            image = source.parent / image
+        records.append({
+            "key": str(row.get("id") or row["image"]),
+            "image": str(image),
+            "question": row.get("question") or question,
+        })
+    return records
+
+
+def shard_of(key, num_shards):
+    # stable across runs and processes, unlike hash()
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % num_shards
+
+
+def read_results(path):
+    """Records of an existing JSONL output, skipping lines torn by a crash."""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def completed_keys(path):
+    """Keys with a successful result in an existing JSONL output."""
+    return {record["key"] for record in read_results(path) if record.get("error") is None}
+
+
+def shard_path(output, index, num_shards):
+    if num_shards == 1:
+        return output
+    path = Path(output)
+    return str(path.with_name(f"{path.stem}.shard-{index}-of-{num_shards}{path.suffix}"))
+
+
+def batches(records, batch_size):
+    for start in range(0, len(records), batch_size):
+        yield records[start:start + batch_size]
+
+
+def decode_batch(pool, batch, policy):
+    """Decode one batch on the pool; returns ``(record, image or exception)`` pairs."""
+    def decode(record):
+        try:
+            return load_image(record["image"], policy)
+        except Exception as e:
+            return e
+    return list(zip(batch, pool.map(decode, batch)))
+
+
+def run_shard(args, index):
+    """Run one shard in this process: decode ahead on a thread pool while Clara generates."""
+    if args.gpus:
+        gpus = args.gpus.split(",")
+        os.environ["CUDA_VISIBLE_DEVICES"] = gpus[index % len(gpus)]
+    # shares the server's compiled graphs; set up, like CUDA_VISIBLE_DEVICES, before torch initialises
+    compile_cache.configure(os.getenv("COMPILE_CACHE_DIR", compile_cache.DEFAULT_CACHE_DIR))
+    from ..model.hf_model import ClaraPipeline
+    compile_cache.load_artifacts(os.getenv("COMPILE_CACHE_DIR", compile_cache.DEFAULT_CACHE_DIR))
+
+    output = shard_path(args.output, index, args.num_shards)
+    done = completed_keys(output)
+    records = [
+        record for record in read_manifest(args.input, args.question)
+        if shard_of(record["key"], args.num_shards) == index and record["key"] not in done
+    ]
+    print(f"[shard {index}] {len(records)} to run, {len(done)} already done -> {output}", flush=True)
+    if not records:
+        return
+
+    pipeline = ClaraPipeline(args.model_path, max_tokens=args.max_tokens, vision_cache_bytes=0)
+    started, finished = time.perf_counter(), 0
+    policy = get_policy(args.resolution)
+    chunks = list(batches(records, args.batch_size))
+    with ThreadPoolExecutor(max_workers=args.decode_workers) as pool, \
+            ThreadPoolExecutor(max_workers=1) as prefetch, \
+            open(output, "a", encoding="utf-8") as out:
+        pending = prefetch.submit(decode_batch, pool, chunks[0], policy)
+        for i in range(len(chunks)):
+            decoded = pending.result()
+            if i + 1 < len(chunks):
+                # decode the next batch while this one is on the GPU
+                pending = prefetch.submit(decode_batch, pool, chunks[i + 1], policy)
+
+            results = [{**record, "output": None, "error": repr(image)}
+                       for record, image in decoded if isinstance(image, Exception)]
+            ready = [(record, image) for record, image in decoded if not isinstance(image, Exception)]
+            if ready:
+                results += generate(pipeline, ready)
+
+            for result in results:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+
+            finished += len(results)
+            rate = finished / (time.perf_counter() - started)
+            print(f"[shard {index}] {finished}/{len(records)} ({rate:.2f} images/s)", flush=True)
+
+
+def generate(pipeline, ready):
+    """One ``run_batch`` call; on failure, retry item by item so one bad input does not sink the batch."""
+    records, images = zip(*ready)
+    started = time.perf_counter()
+    try:
+        outputs = pipeline.run_batch(list(images), [record["question"] for record in records])
+    except Exception:
+        if len(ready) == 1:
+            raise
+        return [result for item in ready for result in generate_one(pipeline, item)]
+    latency = (time.perf_counter() - started) / len(records)
+    return [{**record, "output": output, "error": None, "latency_s": latency}
+            for record, output in zip(records, outputs)]
+
+
+def generate_one(pipeline, item):
+    record, _ = item
+    try:
+        return generate(pipeline, [item])
+    except Exception as e:
+        return [{**record, "output": None, "error": repr(e)}]
+
+
+def merge_outputs(args):
+    """Concatenate shard outputs into ``--output`` (last record per key wins) and write ``--parquet``."""
+    records = [
+        record
+        for index in range(args.num_shards)
+        for record in read_results(shard_path(args.output, index, args.num_shards))
+    ]
+    if not records:
+        return
+    results = pd.DataFrame(records).drop_duplicates("key", keep="last")
+    if args.num_shards > 1:
+        results.to_json(args.output, orient="records", lines=True, force_ascii=False)
+    if args.parquet:
+        results.to_parquet(args.parquet, index=False)
+    failed = results["error"].notna().sum()
+    print(f"{len(results)} results, {failed} failed -> {args.output}" + (f", {args.parquet}" if args.parquet else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--input", required=True, help="image directory, or a .csv/.jsonl manifest")
+    parser.add_argument("--output", required=True, help="JSONL results file, appended to and resumed from")
+    parser.add_argument("--parquet", help="also write all results to this Parquet file at the end")
+    parser.add_argument("--question", default=DEFAULT_QUESTION, help="question for images without one")
+    parser.add_argument("--resolution", default="default", choices=list(PROFILES), help="visual-token budget profile")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--num-shards", type=int, default=1, help="worker processes, each with its own model")
+    parser.add_argument("--gpus", help="comma-separated GPU ids assigned to shards round-robin")
+    args = parser.parse_args(argv)
+
+    if args.num_shards == 1:
+        run_shard(args, 0)
+    else:
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=run_shard, args=(args, index)) for index in range(args.num_shards)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if any(worker.exitcode != 0 for worker in workers):
+            print("some shards failed; rerun the same command to resume", file=sys.stderr)
+    merge_outputs(args)
+
+
+if __name__ == "__main__":
+    main()
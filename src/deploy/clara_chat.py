@@ -3,11 +3,12 @@ import gradio as gr
 import os
 from PIL import Image
 import requests
-import base64
+from .streaming_client import format_stats, iter_sse
 os.environ['GRADIO_TEMP_DIR'] = os.path.expanduser('./tmp')
 
 # Sample preloaded example images (you can replace with actual image paths)
 API_URL = "http://localhost:8314/predict"  # hoặc IP nếu deploy từ xa
+STREAM_URL = f"{API_URL}/stream"
 EXAMPLE_IMAGES = [
     "https://raw.githubusercontent.com/gradio-app/gradio/main/test/test_files/bus.png",
     "https://raw.githubusercontent.com/gradio-app/gradio/main/test/test_files/cheetah1.jpg",
@@ -23,9 +24,10 @@ EXAMPLE_IMAGES_DICT = [
 ]
 
 def api_run(image, message, history, model_number):
-    """Model processing function with model selection"""
+    """Model processing function with model selection; streams the answer into the chat"""
     if image is None:
-        return history + [["Please upload an image first.", None]]
+        yield history + [["Please upload an image first.", None]]
+        return
     
     # Map model number to model name
     model_mapping = {
@@ -38,28 +40,46 @@ def api_run(image, message, history, model_number):
     
     os.makedirs("output", exist_ok=True)
     hash_image = hashlib.md5(image.tobytes()).hexdigest()
-    image.save(os.path.join("output", f"{hash_image}.png"))
-    
-    encoded_image = None
-    with open(f"output/{hash_image}.png", "rb") as img_file:
-        encoded_image = base64.b64encode(img_file.read()).decode("utf-8")
+    image_path = os.path.join("output", f"{hash_image}.png")
+    image.save(image_path)
         
     payload = {
-        "images": encoded_image,
         "text": message,
         "model_name": model_name
     }
     
-    response = requests.post(API_URL, json=payload)
-    text = response.json()["outputs"]
-    
-    if response.status_code == 200:
-        print(f"🧠 {model_name.upper()} Output:\n", text)
-    else:
-        print("❌ Error:", response.status_code, text)
-    
-    history.append([message, text])
-    return history
+    # Upload the image as a binary multipart file and read the answer as server-sent events
+    with open(image_path, "rb") as img_file:
+        response = requests.post(
+            STREAM_URL, data=payload, files={"image": (f"{hash_image}.png", img_file, "image/png")},
+            stream=True,
+        )
+    history.append([message, ""])
+    if response.status_code != 200:
+        print("❌ Error:", response.status_code, response.text)
+        history[-1][1] = f"❌ Error: {response.status_code} - {response.text}"
+        yield history
+        return
+
+    text = ""
+    for event, data in iter_sse(response):
+        if event in ("section", "token"):
+            text += data["text"]
+            history[-1][1] = text
+        elif event == "done":
+            print(f"🧠 {model_name.upper()} Output:\n", text)
+            history[-1][1] = f"{text}\n\n---\n\n*{format_stats(data)}*"
+        elif event == "error":
+            print("❌ Error:", data["detail"])
+            history[-1][1] = f"{text}\n\n❌ Error: {data['detail']}"
+        yield history
+
+
+def streaming_handler(model_number):
+    """Gradio needs a generator function to stream, so wrap ``api_run`` per model."""
+    def handler(img, msg, hist):
+        yield from api_run(img, msg, hist, model_number)
+    return handler
 
 
 def load_example_image(example_path):
@@ -160,7 +180,7 @@ with gr.Blocks(title="Multi-Modal AI Assistant", theme=gr.themes.Soft()) as demo
     )
 
     submit_1.click(
-        fn=lambda img, msg, hist: api_run(img, msg, hist, 1),
+        fn=streaming_handler(1),
         inputs=[image_input, msg_1, chatbot_1],
         outputs=chatbot_1
     ).then(
@@ -169,7 +189,7 @@ with gr.Blocks(title="Multi-Modal AI Assistant", theme=gr.themes.Soft()) as demo
     )
     
     msg_1.submit(
-        fn=lambda img, msg, hist: api_run(img, msg, hist, 1),
+        fn=streaming_handler(1),
         inputs=[image_input, msg_1, chatbot_1],
         outputs=chatbot_1
     ).then(
@@ -179,7 +199,7 @@ with gr.Blocks(title="Multi-Modal AI Assistant", theme=gr.themes.Soft()) as demo
 
     # Event handlers for Model 2 (Gemini)
     submit_2.click(
-        fn=lambda img, msg, hist: api_run(img, msg, hist, 2),
+        fn=streaming_handler(2),
         inputs=[image_input, msg_2, chatbot_2],
         outputs=chatbot_2
     ).then(
@@ -188,7 +208,7 @@ with gr.Blocks(title="Multi-Modal AI Assistant", theme=gr.themes.Soft()) as demo
     )
     
     msg_2.submit(
-        fn=lambda img, msg, hist: api_run(img, msg, hist, 2),
+        fn=streaming_handler(2),
         inputs=[image_input, msg_2, chatbot_2],
         outputs=chatbot_2
     ).then(
@@ -198,7 +218,7 @@ with gr.Blocks(title="Multi-Modal AI Assistant", theme=gr.themes.Soft()) as demo
 
     # Event handlers for Model 3 (ChatGPT)
     submit_3.click(
-        fn=lambda img, msg, hist: api_run(img, msg, hist, 3),
+        fn=streaming_handler(3),
         inputs=[image_input, msg_3, chatbot_3],
         outputs=chatbot_3
     ).then(
@@ -207,7 +227,7 @@ with gr.Blocks(title="Multi-Modal AI Assistant", theme=gr.themes.Soft()) as demo
     )
     
     msg_3.submit(
-        fn=lambda img, msg, hist: api_run(img, msg, hist, 3),
+        fn=streaming_handler(3),
         inputs=[image_input, msg_3, chatbot_3],
         outputs=chatbot_3
     ).then(
@@ -217,4 +237,4 @@ with gr.Blocks(title="Multi-Modal AI Assistant", theme=gr.themes.Soft()) as demo
     clear_3.click(fn=clear_chat, outputs=chatbot_3)
 
 if __name__ == "__main__":
-    demo.launch(share=True, debug=True)
\ No newline at end of file
+    demo.launch(share=True, debug=True)
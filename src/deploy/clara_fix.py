@@ -3,12 +3,14 @@ import gradio as gr
 import os
 from PIL import Image
 import requests
-import base64
+from .streaming_client import format_stats, iter_sse
 
 os.environ['GRADIO_TEMP_DIR'] = os.path.expanduser('./tmp')
 
 # Sample preloaded example images
 API_URL = "http://localhost:8314/predict"
+STREAM_URL = f"{API_URL}/stream"
+COMPARE_URL = f"{API_URL}_all"
 EXAMPLE_IMAGES = [
     "https://raw.githubusercontent.com/gradio-app/gradio/main/test/test_files/bus.png",
     "https://raw.githubusercontent.com/gradio-app/gradio/main/test/test_files/cheetah1.jpg",
@@ -25,9 +27,10 @@ EXAMPLE_IMAGES_DICT = [
 
 
 def api_run(image, model_number, messages= None):
-    """API call function for different models"""
+    """API call function for different models; yields the answer as it streams in"""
     if image is None:
-        return "Please upload an image first."
+        yield "Please upload an image first."
+        return
     
     # Map model number to model name
     model_mapping = {
@@ -41,11 +44,8 @@ def api_run(image, model_number, messages= None):
     os.makedirs("output", exist_ok=True)
     # Hash image content
     hash_image = hashlib.md5(image.tobytes()).hexdigest()
-    image.save(os.path.join("output", f"{hash_image}.png"))
-    
-    # Convert image to base64
-    with open(f"output/{hash_image}.png", "rb") as img_file:
-        encoded_image = base64.b64encode(img_file.read()).decode("utf-8")
+    image_path = os.path.join("output", f"{hash_image}.png")
+    image.save(image_path)
     
     if messages is None:
         messages = ' "Ảnh X-quang này có gì bất thường?"'
@@ -54,19 +54,83 @@ def api_run(image, model_number, messages= None):
     
     # Prepare request payload
     payload = {
-        "images": encoded_image,
         "text": messages,
         "model_name": model_name
     }
     
     try:
-        response = requests.post(API_URL, json=payload)
-        if response.status_code == 200:
-            return response.json()["outputs"]
-        else:
-            return f"❌ Error: {response.status_code} - {response.text}"
+        # Upload the image as a binary multipart file and read the answer as server-sent events
+        with open(image_path, "rb") as img_file:
+            response = requests.post(
+                STREAM_URL, data=payload, files={"image": (f"{hash_image}.png", img_file, "image/png")},
+                stream=True,
+            )
+        if response.status_code != 200:
+            yield f"❌ Error: {response.status_code} - {response.text}"
+            return
+
+        text = ""
+        for event, data in iter_sse(response):
+            if event in ("section", "token"):
+                text += data["text"]
+                yield text
+            elif event == "done":
+                yield f"{text}\n\n---\n\n*{format_stats(data)}*"
+            elif event == "error":
+                yield f"{text}\n\n❌ Error: {data['detail']}"
+    except Exception as e:
+        yield f"❌ Connection Error: {str(e)}"
+
+
+def compare_all(image, messages=None):
+    """Ask all three models in one /predict_all call; yields (clara, gemini, chatgpt) markdown as answers land"""
+    if image is None:
+        yield ("Please upload an image first.",) * 3
+        return
+
+    model_names = ["clara", "gemini", "gpt"]
+    outputs = {name: "⏳ Waiting for answer..." for name in model_names}
+    yield tuple(outputs[name] for name in model_names)
+
+    os.makedirs("output", exist_ok=True)
+    hash_image = hashlib.md5(image.tobytes()).hexdigest()
+    image_path = os.path.join("output", f"{hash_image}.png")
+    image.save(image_path)
+
+    payload = {
+        "text": messages or ' "Ảnh X-quang này có gì bất thường?"',
+        "model_names": ",".join(model_names)
+    }
+
+    try:
+        # One upload; the server runs the models concurrently and streams each answer when ready
+        with open(image_path, "rb") as img_file:
+            response = requests.post(
+                COMPARE_URL, data=payload, files={"image": (f"{hash_image}.png", img_file, "image/png")},
+                stream=True,
+            )
+        if response.status_code != 200:
+            yield (f"❌ Error: {response.status_code} - {response.text}",) * 3
+            return
+
+        for event, data in iter_sse(response):
+            if event == "result":
+                footer = "⏱️ cached answer" if data["cached"] else f"⏱️ {data['latency_s']:.1f} s"
+                outputs[data["model_name"]] = f"{data['outputs']}\n\n---\n\n*{footer}*"
+            elif event == "error" and "model_name" in data:
+                outputs[data["model_name"]] = f"❌ Error: {data['detail']}"
+            else:
+                continue
+            yield tuple(outputs[name] for name in model_names)
     except Exception as e:
-        return f"❌ Connection Error: {str(e)}"
+        yield (f"❌ Connection Error: {str(e)}",) * 3
+
+
+def streaming_handler(model_number):
+    """Gradio needs a generator function to stream, so wrap ``api_run`` per model."""
+    def handler(img, msg):
+        yield from api_run(img, model_number, msg)
+    return handler
 
 # def load_example_image(selection: gr.SelectData):
 #     """Load example image from gallery"""
@@ -125,6 +189,8 @@ with gr.Blocks(title="Multi-Modal AI Assistant", theme=gr.themes.Soft(), css=css
                                            elem_id="chatgpt-output", elem_classes=["output-box"])
                     submit_3 = gr.Button("Send", scale=1, variant="primary")
 
+            compare_button = gr.Button("Compare all", variant="secondary")
+
     def load_example(evt: gr.SelectData):
         selected_example = EXAMPLE_IMAGES_DICT[evt.index]
         image_path = next(v for k, v in selected_example.items() if k.startswith("images_"))
@@ -138,24 +204,30 @@ with gr.Blocks(title="Multi-Modal AI Assistant", theme=gr.themes.Soft(), css=css
 
     # Submit button events with clear output
     submit_1.click(
-        fn=lambda img, msg: api_run(img, 1, msg),
+        fn=streaming_handler(1),
         inputs=[image_input, messages],
         outputs=output_1
     ).then(fn=lambda: "", outputs=messages)
 
     submit_2.click(
-        fn=lambda img, msg: api_run(img, 2, msg),
+        fn=streaming_handler(2),
         inputs=[image_input, messages],
         outputs=output_2
     ).then(fn=lambda: "", outputs=messages)
 
     submit_3.click(
-        fn=lambda img, msg: api_run(img, 3, msg),
+        fn=streaming_handler(3),
         inputs=[image_input, messages],
         outputs=output_3
     ).then(fn=lambda: "", outputs=messages)
 
+    compare_button.click(
+        fn=compare_all,
+        inputs=[image_input, messages],
+        outputs=[output_1, output_2, output_3]
+    ).then(fn=lambda: "", outputs=messages)
+
 
 
 if __name__ == "__main__":
-    demo.launch(share=True, debug=True)
\ No newline at end of file
+    demo.launch(share=True, debug=True)
@@ -0,0 +1,27 @@
+"""Client side of the ``/predict/stream`` server-sent events, shared by the Gradio UIs."""
+import json
+
+
+def iter_sse(response):
+    """Yield ``(event, data)`` pairs from a ``text/event-stream`` response."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            field, _, value = line.partition(":")
+            if field == "event":
+                event = value.strip()
+            elif field == "data":
+                data.append(value.strip())
+        elif data:
+            yield event, json.loads("\n".join(data))
+            event, data = "message", []
+
+
+def format_stats(done):
+    """One-line footer with time-to-first-token and generation speed."""
+    if done.get("cached"):
+        return "⏱️ cached answer"
+    ttft = done.get("ttft_s") or 0.0
+    decode_time = done["total_s"] - ttft
+    rate = done["tokens"] / decode_time if done.get("tokens") and decode_time > 0 else 0.0
+    return f"⏱️ TTFT {ttft:.2f} s · {rate:.1f} tokens/s · total {done['total_s']:.1f} s"
@@ -1,14 +1,47 @@
 import os
+import asyncio
 import base64
+import importlib.util
 from io import BytesIO
 from PIL import Image
 from dotenv import load_dotenv
 import google.generativeai as genai
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, OpenAI
 
 # Load .env once
 load_dotenv()
 
+_http_client = None
+
+
+def shared_http_client() -> httpx.AsyncClient:
+    """Process-wide async HTTP client, so remote-model calls reuse warm connections.
+
+    Uses HTTP/2 when the optional ``h2`` package is installed; pool size and
+    keep-alive are read from ``REMOTE_MAX_CONNECTIONS``, ``REMOTE_MAX_KEEPALIVE``
+    and ``REMOTE_KEEPALIVE_EXPIRY``.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("REMOTE_MAX_CONNECTIONS", "200")),
+                max_keepalive_connections=int(os.getenv("REMOTE_MAX_KEEPALIVE", "50")),
+                keepalive_expiry=float(os.getenv("REMOTE_KEEPALIVE_EXPIRY", "30")),
+            ),
+            timeout=httpx.Timeout(120.0, connect=10.0),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
 # === GEMINI PIPELINE ===
 class GeminiMedicalPipeline:
@@ -42,6 +75,29 @@ Hãy giữ văn phong y khoa rõ ràng, không phỏng đoán nếu không có c
         response = self.model.generate_content([prompt, image])
         return response.text
 
+    async def run_async(self, image: Image.Image, user_instruction: str) -> str:
+        """Non-blocking ``run``: the SDK's async gRPC client multiplexes calls over one channel."""
+        prompt = self.build_prompt(user_instruction)
+        response = await self.model.generate_content_async([prompt, image])
+        return response.text
+
+    def stream(self, image: Image.Image, user_instruction: str):
+        """Yield ``("text", chunk)`` as Gemini produces it, then ``("tokens", n)`` when usage is known."""
+        prompt = self.build_prompt(user_instruction)
+        tokens = None
+        for chunk in self.model.generate_content([prompt, image], stream=True):
+            try:
+                text = chunk.text
+            except ValueError:  # chunks without parts, e.g. the final finish_reason
+                text = ""
+            if text:
+                yield "text", text
+            usage = getattr(chunk, "usage_metadata", None)
+            if usage is not None and usage.candidates_token_count:
+                tokens = usage.candidates_token_count
+        if tokens:
+            yield "tokens", tokens
+
 
 # === OPENROUTER (ChatGPT/Gemini/GPT-4-Vision) PIPELINE ===
 class ChatGPTMedicalVisionPipeline:
@@ -53,6 +109,11 @@ class ChatGPTMedicalVisionPipeline:
             base_url="https://openrouter.ai/api/v1",
             api_key=api_key
         )
+        self.async_client = AsyncOpenAI(
+            base_url="https://openrouter.ai/api/v1",
+            api_key=api_key,
+            http_client=shared_http_client(),
+        )
         self.model = model
 
     def image_to_base64(self, image: Image.Image) -> str:
@@ -78,10 +139,10 @@ Hãy xem xét ảnh y tế bên dưới và phân tích **bằng định dạng
 {user_instruction}
 """
 
-    def run(self, image: Image.Image, user_instruction: str) -> str:
+    def build_request(self, image: Image.Image, user_instruction: str) -> dict:
         image_base64 = self.image_to_base64(image)
 
-        response = self.client.chat.completions.create(
+        return dict(
             model=self.model,
             extra_headers={
                 "HTTP-Referer": "https://yourdomain.com",  # tùy chọn
@@ -104,5 +165,29 @@ Hãy xem xét ảnh y tế bên dưới và phân tích **bằng định dạng
             max_tokens=1024
         )
 
+    def run(self, image: Image.Image, user_instruction: str) -> str:
+        response = self.client.chat.completions.create(**self.build_request(image, user_instruction))
+
+        return response.choices[0].message.content
+
+    async def run_async(self, image: Image.Image, user_instruction: str) -> str:
+        """Non-blocking ``run`` over the shared connection pool."""
+        # PNG + base64 encoding is CPU work, keep it off the event loop
+        request = await asyncio.to_thread(self.build_request, image, user_instruction)
+        response = await self.async_client.chat.completions.create(**request)
+
         return response.choices[0].message.content
+
+    def stream(self, image: Image.Image, user_instruction: str):
+        """Yield ``("text", delta)`` for each streamed chunk, then ``("tokens", n)`` from the usage chunk."""
+        response = self.client.chat.completions.create(
+            **self.build_request(image, user_instruction),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield "text", chunk.choices[0].delta.content
+            if getattr(chunk, "usage", None) is not None and chunk.usage.completion_tokens:
+                yield "tokens", chunk.usage.completion_tokens
     
@@ -0,0 +1,138 @@
+"""Ahead-of-time warm-up and a persistent compile cache for Clara.
+
+The functions in ``unsloth_compiled_cache/`` are ``torch.compile(dynamic=True)``
+and compile on first call, so the first requests after a restart pay for
+Dynamo tracing, Inductor codegen and Triton autotuning. ``configure`` puts the
+Inductor FX-graph/AOT-autograd and Triton caches in a persistent directory.
+``load_artifacts``/``save_artifacts`` round-trip torch's portable cache
+artifacts. ``warm_up`` drives every expected shape bucket through the request
+paths before the model is marked ready.
+
+    python -m src.model.compile_cache --model-path /path/to/model --profiles all --batch-sizes 1,4
+"""
+import argparse
+import os
+import time
+
+from PIL import Image
+
+from .resolution import PROFILES
+
+ARTIFACTS_FILE = "compile_artifacts.bin"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "clara", "compile")
+# square, portrait and landscape inputs; the resolution policy maps each onto its grid bucket
+BUCKET_SOURCE_SIZES = ((1024, 1024), (2048, 2500), (3000, 2000))
+
+
+def configure(cache_dir=DEFAULT_CACHE_DIR):
+    """Persistent Inductor and Triton caches; must run before ``torch`` is imported."""
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor"))
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+    os.environ.setdefault("TRITON_CACHE_DIR", os.path.join(cache_dir, "triton"))
+
+
+def load_artifacts(cache_dir=DEFAULT_CACHE_DIR):
+    """Load artifacts saved by a previous run; returns whether any were found."""
+    path = os.path.join(cache_dir, ARTIFACTS_FILE)
+    if not os.path.isfile(path):
+        return False
+    import torch
+
+    with open(path, "rb") as f:
+        torch.compiler.load_cache_artifacts(f.read())
+    return True
+
+
+def save_artifacts(cache_dir=DEFAULT_CACHE_DIR):
+    """Save everything compiled in this process; returns the number of bytes written."""
+    import torch
+
+    artifacts = torch.compiler.save_cache_artifacts()
+    if artifacts is None:
+        return 0
+    data, _ = artifacts
+    path = os.path.join(cache_dir, ARTIFACTS_FILE)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    return len(data)
+
+
+def shape_buckets(profiles):
+    """``(name, (width, height))`` for every distinct resized image shape the profiles produce."""
+    seen = set()
+    for profile in profiles:
+        policy = PROFILES[profile]
+        for width, height in BUCKET_SOURCE_SIZES:
+            size = policy.target_size(width, height)
+            if size not in seen:
+                seen.add(size)
+                yield f"{profile}-{size[0]}x{size[1]}", size
+
+
+def warm_up(pipeline, profiles=("default",), batch_sizes=(1,), max_new_tokens=4):
+    """Run every shape bucket through ``run`` (and ``run_batch`` per batch size) with short generations.
+
+    Returns a report with the cold latency of each bucket and, for the first
+    bucket, the latency of the same request once everything is compiled.
+    """
+    quiet = lambda kind, payload: None  # noqa: E731
+    max_tokens, pipeline.max_tokens = pipeline.max_tokens, max_new_tokens
+    started = time.perf_counter()
+    report = {"buckets": []}
+    try:
+        buckets = list(shape_buckets(profiles))
+        for shade, (name, size) in enumerate(buckets):
+            # a distinct fill per call so the vision feature cache cannot short-cut the vision tower
+            image = Image.new("RGB", size, (shade, shade, shade))
+            call_started = time.perf_counter()
+            pipeline.run(image, "warm-up", on_event=quiet)
+            report["buckets"].append({"bucket": name, "first_s": time.perf_counter() - call_started})
+
+        for batch_size in batch_sizes:
+            if batch_size > 1:
+                images = [Image.new("RGB", buckets[0][1], (64 + i, 0, 0)) for i in range(batch_size)]
+                call_started = time.perf_counter()
+                pipeline.run_batch(images, ["warm-up"] * batch_size)
+                report["buckets"].append({"bucket": f"batch-{batch_size}", "first_s": time.perf_counter() - call_started})
+
+        image = Image.new("RGB", buckets[0][1], (255, 255, 255))
+        call_started = time.perf_counter()
+        pipeline.run(image, "warm-up", on_event=quiet)
+        report["first_request_s"] = report["buckets"][0]["first_s"]
+        report["warm_request_s"] = time.perf_counter() - call_started
+    finally:
+        pipeline.max_tokens = max_tokens
+    report["total_s"] = time.perf_counter() - started
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm up Clara over the shape buckets and save compile artifacts")
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--profiles", default="default", help="comma-separated resolution profiles, or 'all'")
+    parser.add_argument("--batch-sizes", default="1")
+    args = parser.parse_args()
+
+    configure(args.cache_dir)
+    loaded = load_artifacts(args.cache_dir)
+    from .hf_model import ClaraPipeline
+
+    pipeline = ClaraPipeline(args.model_path, vision_cache_bytes=0)
+    profiles = list(PROFILES) if args.profiles == "all" else args.profiles.split(",")
+    report = warm_up(pipeline, profiles, [int(b) for b in args.batch_sizes.split(",")])
+    saved = save_artifacts(args.cache_dir)
+
+    print(f"artifacts loaded: {loaded}, saved: {saved / 2**20:.1f} MiB -> {args.cache_dir}")
+    print("| bucket | first call (s) |")
+    print("|---|---|")
+    for bucket in report["buckets"]:
+        print(f"| {bucket['bucket']} | {bucket['first_s']:.2f} |")
+    print(f"first request {report['first_request_s']:.2f}s -> after warm-up {report['warm_request_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+from transformers.cache_utils import Cache, DynamicCache
+
+from .streaming import CallbackStreamer
+
+
+class SlotKVCache(Cache):
+    """Fixed pool of per-sequence KV slots shared by every running sequence.
+
+    Each slot owns ``max_len`` positions per layer. A decode step writes the new
+    key/value of every running sequence at that sequence's own length inside its
+    slot and attends over the first ``span`` positions; positions a sequence has
+    not written yet are hidden by the attention mask, so sequences of different
+    lengths can share one step without re-padding their caches.
+
+    The ``n`` running sequences occupy slots ``0..n-1`` in batch order, so each
+    step attends over a view of the leading slots rather than a gathered copy of
+    every running slot's KV; the engine keeps them packed with ``move``.
+    """
+
+    def __init__(self, num_slots, max_len):
+        super().__init__()
+        self.num_slots = num_slots
+        self.max_len = max_len
+        self.key_slots = []
+        self.value_slots = []
+        self._rows = None
+        self._positions = None
+        self._span = 0
+
+    def allocate(self, prefill_cache):
+        """Size the pool from the first prefill cache (layers, kv heads, head dim, dtype)."""
+        for layer_idx in range(len(prefill_cache)):
+            key, _ = prefill_cache[layer_idx]
+            _, num_heads, _, head_dim = key.shape
+            shape = (self.num_slots, num_heads, self.max_len, head_dim)
+            self.key_slots.append(torch.zeros(shape, dtype=key.dtype, device=key.device))
+            self.value_slots.append(torch.zeros(shape, dtype=key.dtype, device=key.device))
+
+    @property
+    def allocated(self):
+        return bool(self.key_slots)
+
+    def load(self, slot, prefill_cache):
+        """Copy a batch-size-1 prefill cache into ``slot``; returns the prompt length."""
+        length = 0
+        for layer_idx in range(len(prefill_cache)):
+            key, value = prefill_cache[layer_idx]
+            length = key.shape[2]
+            self.key_slots[layer_idx][slot, :, :length] = key[0]
+            self.value_slots[layer_idx][slot, :, :length] = value[0]
+        return length
+
+    def move(self, src, dst, length):
+        """Copy the first ``length`` positions of slot ``src`` into slot ``dst``."""
+        for keys, values in zip(self.key_slots, self.value_slots):
+            keys[dst, :, :length] = keys[src, :, :length]
+            values[dst, :, :length] = values[src, :, :length]
+
+    def begin_step(self, positions):
+        """Start a decode step over slots ``0..len(positions)-1``, each writing at its own position."""
+        self._rows = torch.arange(len(positions), device=positions.device)
+        self._positions = positions
+        self._span = int(positions.max().item()) + 1
+
+    def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+        n = len(self._rows)
+        keys = self.key_slots[layer_idx]
+        values = self.value_slots[layer_idx]
+        keys[self._rows, :, self._positions] = key_states[:, :, -1]
+        values[self._rows, :, self._positions] = value_states[:, :, -1]
+        return keys[:n, :, :self._span], values[:n, :, :self._span]
+
+    def get_seq_length(self, layer_idx=0):
+        return max(self._span - 1, 0)
+
+    def get_max_cache_shape(self):
+        return None
+
+    def get_mask_sizes(self, cache_position, layer_idx=0):
+        return self._span, 0
+
+    def nbytes(self):
+        return sum(t.numel() * t.element_size() for t in self.key_slots + self.value_slots)
+
+
+class GenerationRequest:
+    def __init__(self, inputs, max_new_tokens, on_token=None):
+        self.inputs = inputs
+        self.max_new_tokens = max_new_tokens
+        self.on_token = on_token
+        self.future = Future()
+        self.generated = []
+        self.slot = None
+        self.length = 0
+        self.rope_delta = 0
+        self.submitted_at = time.perf_counter()
+        self.admitted_at = None
+        self.finished_at = None
+
+    @property
+    def queue_wait(self):
+        end = self.admitted_at if self.admitted_at is not None else time.perf_counter()
+        return end - self.submitted_at
+
+
+class ContinuousBatchingEngine:
+    """Iteration-level scheduler for a Qwen2-VL ``model``.
+
+    Every loop iteration admits waiting requests into free KV slots (one prefill
+    each, including the vision tower), then runs a single decode step over all
+    running sequences. Sequences that hit EOS or their token budget leave the
+    batch immediately and free their slot for the next waiting request, so one
+    long report never holds up short ones.
+
+    Decoding is greedy regardless of ``model.generation_config``'s sampling
+    settings; only its ``eos_token_id`` is used. The engine only relies on
+    ``model``'s device, so it runs on CPU as well, e.g. with a tiny
+    ``Qwen2VLConfig`` and random weights.
+    """
+
+    def __init__(self, model, processor, max_slots=8, max_len=1536, max_new_tokens=512):
+        self.model = model
+        self.processor = processor
+        self.max_slots = max_slots
+        self.max_len = max_len
+        self.max_new_tokens = max_new_tokens
+        self.device = next(model.parameters()).device
+
+        eos = model.generation_config.eos_token_id
+        eos = [eos] if isinstance(eos, int) else list(eos or [])
+        tokenizer = getattr(processor, "tokenizer", processor)
+        if tokenizer.eos_token_id is not None:
+            eos.append(tokenizer.eos_token_id)
+        self.eos_token_ids = set(eos)
+
+        self.cache = SlotKVCache(max_slots, max_len)
+        self._running = []  # request i holds slot i
+        self._waiting = queue.Queue()
+        self._stopped = False
+
+        self.steps = 0
+        self.prefills = 0
+        self.completed = 0
+        self.tokens_generated = 0
+        self.total_running = 0
+        self.total_queue_wait = 0.0
+
+        self._thread = threading.Thread(target=self._loop, name="continuous-batching", daemon=True)
+        self._thread.start()
+
+    def submit(self, inputs, max_new_tokens=None, on_token=None):
+        """Queue one tokenized prompt (batch size 1); returns a ``concurrent.futures.Future`` with the text.
+
+        ``on_token`` is called from the engine thread with each new token id.
+        """
+        if self._stopped:
+            raise RuntimeError("continuous batching engine is closed")
+        request = GenerationRequest(inputs, max_new_tokens or self.max_new_tokens, on_token)
+        self._waiting.put(request)
+        return request
+
+    def _loop(self):
+        while not self._stopped:
+            try:
+                self._admit()
+                if self._running:
+                    self._decode_step()
+            except Exception as e:
+                for request in list(self._running):
+                    self._finish(request, error=e)
+        self._fail_pending()
+
+    def _fail_pending(self):
+        """Fail every running and waiting request once the engine is closed."""
+        error = RuntimeError("continuous batching engine closed")
+        for request in list(self._running):
+            self._finish(request, error=error)
+        while True:
+            try:
+                request = self._waiting.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None and not request.future.done():
+                self._finish(request, error=error)
+
+    def _admit(self):
+        while len(self._running) < self.max_slots:
+            try:
+                # block only when nothing is running, otherwise keep decoding
+                request = self._waiting.get(block=not self._running, timeout=0.1)
+            except queue.Empty:
+                return
+            if request is None:
+                return
+            try:
+                self._prefill(request)
+            except Exception as e:
+                self._finish(request, error=e)
+
+    @torch.inference_mode()
+    def _prefill(self, request):
+        request.admitted_at = time.perf_counter()
+        self.total_queue_wait += request.queue_wait
+        inputs = request.inputs.to(self.device)
+        if inputs["input_ids"].shape[1] >= self.max_len:
+            raise ValueError(f"Prompt of {inputs['input_ids'].shape[1]} tokens does not fit a {self.max_len} token slot")
+
+        prefill_cache = DynamicCache()
+        # only the last position's logits are needed to pick the first token
+        outputs = self.model(
+            **inputs, past_key_values=prefill_cache, use_cache=True, return_dict=True, logits_to_keep=1
+        )
+        self.prefills += 1
+
+        if not self.cache.allocated:
+            self.cache.allocate(outputs.past_key_values)
+        request.slot = len(self._running)
+        request.length = self.cache.load(request.slot, outputs.past_key_values)
+        request.rope_delta = int(outputs.rope_deltas.reshape(-1)[0]) if outputs.rope_deltas is not None else 0
+        self._running.append(request)
+
+        self._accept(request, int(outputs.logits[0, -1].argmax()))
+
+    @torch.inference_mode()
+    def _decode_step(self):
+        running = list(self._running)
+        positions = torch.tensor([r.length for r in running], device=self.device)
+        self.cache.begin_step(positions)
+        span = self.cache._span
+
+        input_ids = torch.tensor([[r.generated[-1]] for r in running], device=self.device)
+        attention_mask = (torch.arange(span, device=self.device)[None, :] <= positions[:, None]).long()
+        rope_deltas = torch.tensor([r.rope_delta for r in running], device=self.device)
+        position_ids = (positions + rope_deltas).view(1, -1, 1).expand(3, -1, -1)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=self.cache,
+            use_cache=True,
+            cache_position=torch.tensor([span - 1], device=self.device),
+            return_dict=True,
+            logits_to_keep=1,
+        )
+        self.steps += 1
+        self.total_running += len(running)
+
+        next_tokens = outputs.logits[:, -1].argmax(-1).tolist()
+        for request, token in zip(running, next_tokens):
+            request.length += 1
+            self._accept(request, token)
+
+    def _accept(self, request, token):
+        request.generated.append(token)
+        self.tokens_generated += 1
+        if request.on_token is not None:
+            request.on_token(token)
+        if (
+            token in self.eos_token_ids
+            or len(request.generated) >= request.max_new_tokens
+            or request.length + 1 >= self.max_len
+        ):
+            self._finish(request)
+
+    def _finish(self, request, error=None):
+        request.finished_at = time.perf_counter()
+        if request in self._running:
+            # the last running sequence takes over the freed slot, keeping slots 0..n-1 packed
+            last = self._running.pop()
+            if last is not request:
+                # up to the position written this step, whether or not its length was advanced yet
+                self.cache.move(last.slot, request.slot, min(last.length + 1, self.max_len))
+                last.slot = request.slot
+                self._running[request.slot] = last
+        request.slot = None
+        if error is not None:
+            request.future.set_exception(error)
+            return
+        self.completed += 1
+        text = self.processor.batch_decode(
+            [request.generated], skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )[0]
+        request.future.set_result(text)
+
+    def stats(self):
+        return {
+            "running": len(self._running),
+            "waiting": self._waiting.qsize(),
+            "free_slots": self.max_slots - len(self._running),
+            "max_slots": self.max_slots,
+            "steps": self.steps,
+            "prefills": self.prefills,
+            "completed": self.completed,
+            "tokens_generated": self.tokens_generated,
+            "avg_running_batch": self.total_running / self.steps if self.steps else 0.0,
+            "avg_queue_wait_s": self.total_queue_wait / self.prefills if self.prefills else 0.0,
+            "kv_slot_bytes": self.cache.nbytes(),
+        }
+
+    def close(self, timeout=None):
+        """Stop the engine; requests still running or waiting fail with ``RuntimeError``."""
+        self._stopped = True
+        self._waiting.put(None)
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            # anything submitted while the loop was shutting down
+            self._fail_pending()
+
+
+class ClaraReportRequest:
+    """Both Clara turns for one image, scheduled on a ``ContinuousBatchingEngine``."""
+
+    def __init__(self, backend, image, question, on_event=None):
+        self.queue_wait = 0.0
+        self.task = asyncio.ensure_future(backend._run(self, image, question, on_event))
+
+    def __await__(self):
+        return self.task.__await__()
+
+
+class ContinuousClaraBackend:
+    """Drop-in Clara backend for the API server built on ``ContinuousBatchingEngine``."""
+
+    def __init__(self, pipeline, max_slots=8):
+        self.pipeline = pipeline
+        self.engine = ContinuousBatchingEngine(
+            pipeline.model,
+            pipeline.tokenizer,
+            max_slots=max_slots,
+            max_len=pipeline.max_seq_length + pipeline.max_tokens,
+            max_new_tokens=pipeline.max_tokens,
+        )
+
+    def submit(self, image, question, on_event=None):
+        """Start a two-turn report; must be called from the event loop.
+
+        ``on_event`` receives the same streaming events as ``ClaraPipeline.run``.
+        """
+        return ClaraReportRequest(self, image, question, on_event)
+
+    async def _generate(self, report, conversation, image, on_event=None):
+        inputs = await asyncio.to_thread(self.pipeline.prepare_inputs, conversation, image)
+        on_token, streamer = None, None
+        if on_event is not None:
+            streamer = CallbackStreamer(self.pipeline.tokenizer, on_event, skip_prompt=False)
+            on_token = lambda token: streamer.put(torch.tensor([token]))
+        request = self.engine.submit(inputs, on_token=on_token)
+        text = await asyncio.wrap_future(request.future)
+        if streamer is not None:
+            streamer.end()
+        report.queue_wait += request.queue_wait
+        return text
+
+    async def _run(self, report, image, question, on_event=None):
+        emit = on_event or (lambda kind, payload: None)
+        conversation = self.pipeline.build_conversation(image, question)
+        emit("section", self.pipeline.findings_header)
+        response_1 = await self._generate(report, conversation, image, on_event)
+        self.pipeline.add_follow_up(conversation, response_1)
+        emit("section", self.pipeline.conclusion_header)
+        response_2 = await self._generate(report, conversation, image, on_event)
+        return self.pipeline.format_report(response_1, response_2)
+
+    def stats(self):
+        return self.engine.stats()
+
+    def close(self, timeout=None):
+        self.engine.close(timeout)
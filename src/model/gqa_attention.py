@@ -0,0 +1,173 @@
+import inspect
+import math
+
+import torch
+from torch import nn
+from transformers.modeling_flash_attention_utils import _flash_attention_forward
+from transformers.models.qwen2_vl.modeling_qwen2_vl import apply_multimodal_rotary_pos_emb
+
+from .patching import bind_forward, patch
+
+
+@torch.compile(fullgraph=True, dynamic=True)
+def eager_attention_forward(module, query, key, value, attention_mask, scaling, dropout=0.0, **kwargs):
+    """Qwen2's ``eager_attention_forward`` without ``repeat_kv``.
+
+    The n_rep query heads that share a key/value head are folded into its row
+    dimension, (b, heads, q, d) -> (b, kv_heads, n_rep * q, d), so each K/V head
+    serves its query heads in one matmul and K/V are never copied.
+    """
+    bsz, num_heads, q_len, head_dim = query.shape
+    num_key_value_heads = key.shape[1]
+    grouped_shape = (bsz, num_key_value_heads, num_heads // num_key_value_heads * q_len, head_dim)
+
+    attn_weights = torch.matmul(query.reshape(grouped_shape), key.transpose(2, 3)) * scaling
+    attn_weights = attn_weights.view(bsz, num_heads, q_len, key.shape[-2])
+    if attention_mask is not None:
+        causal_mask = attention_mask[:, :, :, : key.shape[-2]]
+        attn_weights = attn_weights + causal_mask
+
+    attn_weights = nn.functional.softmax(attn_weights, dim=-1, dtype=torch.float32).to(query.dtype)
+    attn_weights = nn.functional.dropout(attn_weights, p=dropout, training=module.training)
+    attn_output = torch.matmul(attn_weights.view(*grouped_shape[:3], -1), value)
+    attn_output = attn_output.view(bsz, num_heads, q_len, head_dim)
+    attn_output = attn_output.transpose(1, 2).contiguous()
+
+    return attn_output, attn_weights
+
+
+eager_attention_forward.clara_patch = "grouped_kv_attention"
+
+
+def _project(self, hidden_states, past_key_value, cache_position, position_embeddings):
+    """q/k/v with multimodal rope applied and the cache updated, as (b, heads, len, d)."""
+    bsz, q_len, _ = hidden_states.size()
+    query_states = self.q_proj(hidden_states).view(bsz, q_len, -1, self.head_dim).transpose(1, 2)
+    key_states = self.k_proj(hidden_states).view(bsz, q_len, -1, self.head_dim).transpose(1, 2)
+    value_states = self.v_proj(hidden_states).view(bsz, q_len, -1, self.head_dim).transpose(1, 2)
+
+    cos, sin = position_embeddings
+    query_states, key_states = apply_multimodal_rotary_pos_emb(
+        query_states, key_states, cos, sin, self.rope_scaling["mrope_section"]
+    )
+    if past_key_value is not None:
+        cache_kwargs = {"sin": sin, "cos": cos, "cache_position": cache_position}
+        key_states, value_states = past_key_value.update(key_states, value_states, self.layer_idx, cache_kwargs)
+    return query_states, key_states, value_states
+
+
+@patch("grouped_kv_attention")
+def grouped_attention_forward(
+    self,
+    hidden_states,
+    attention_mask=None,
+    position_ids=None,
+    past_key_value=None,
+    output_attentions=False,
+    use_cache=False,
+    cache_position=None,
+    position_embeddings=None,
+):
+    """``Qwen2VLAttention.forward`` with query heads folded onto their shared K/V head instead of ``repeat_kv``."""
+    bsz, q_len, _ = hidden_states.size()
+    query_states, key_states, value_states = _project(
+        self, hidden_states, past_key_value, cache_position, position_embeddings
+    )
+
+    kv_len = key_states.shape[-2]
+    grouped_shape = (bsz, self.num_key_value_heads, self.num_key_value_groups * q_len, self.head_dim)
+    attn_weights = torch.matmul(query_states.reshape(grouped_shape), key_states.transpose(2, 3)) / math.sqrt(self.head_dim)
+    attn_weights = attn_weights.view(bsz, self.num_heads, q_len, kv_len)
+    if attention_mask is not None:
+        attn_weights = attn_weights + attention_mask[:, :, :, :kv_len]
+    # float16 inference: zero out inf scores so they do not turn into NaN
+    if query_states.dtype == torch.float16:
+        attn_weights = torch.where(torch.isinf(attn_weights), torch.zeros_like(attn_weights), attn_weights)
+
+    attn_weights = nn.functional.softmax(attn_weights, dim=-1, dtype=torch.float32).to(query_states.dtype)
+    attn_weights = nn.functional.dropout(attn_weights, p=self.attention_dropout, training=self.training)
+    attn_output = torch.matmul(attn_weights.view(*grouped_shape[:3], kv_len), value_states)
+    attn_output = attn_output.view(bsz, self.num_heads, q_len, self.head_dim)
+
+    attn_output = attn_output.transpose(1, 2).reshape(bsz, q_len, -1)
+    attn_output = self.o_proj(attn_output)
+    return attn_output, attn_weights if output_attentions else None, past_key_value
+
+
+@patch("grouped_kv_attention")
+def grouped_flash_attention_forward(
+    self,
+    hidden_states,
+    attention_mask=None,
+    position_ids=None,
+    past_key_value=None,
+    output_attentions=False,
+    use_cache=False,
+    cache_position=None,
+    position_embeddings=None,
+):
+    """``Qwen2VLFlashAttention2.forward`` passing the grouped K/V heads straight to flash-attn."""
+    bsz, q_len, _ = hidden_states.size()
+    query_states, key_states, value_states = _project(
+        self, hidden_states, past_key_value, cache_position, position_embeddings
+    )
+
+    # layer norms upcast by PEFT leave float32 hidden states; flash-attn needs half precision
+    if query_states.dtype == torch.float32:
+        if torch.is_autocast_enabled():
+            target_dtype = torch.get_autocast_gpu_dtype()
+        elif hasattr(self.config, "_pre_quantization_dtype"):
+            target_dtype = self.config._pre_quantization_dtype
+        else:
+            target_dtype = self.q_proj.weight.dtype
+        query_states, key_states, value_states = (x.to(target_dtype) for x in (query_states, key_states, value_states))
+
+    sliding_window = None
+    if (
+        self.config.use_sliding_window
+        and getattr(self.config, "sliding_window", None) is not None
+        and self.layer_idx >= self.config.max_window_layers
+    ):
+        sliding_window = self.config.sliding_window
+
+    attn_output = _flash_attention_forward(
+        query_states.transpose(1, 2),
+        key_states.transpose(1, 2),
+        value_states.transpose(1, 2),
+        attention_mask,
+        q_len,
+        dropout=0.0 if not self.training else self.attention_dropout,
+        sliding_window=sliding_window,
+        is_causal=self.is_causal,
+        use_top_left_mask=self._flash_attn_uses_top_left_mask,
+    )
+    attn_output = self.o_proj(attn_output.reshape(bsz, q_len, -1).contiguous())
+    return attn_output, None, past_key_value
+
+
+# attention classes (exact type name) and the forward that replaces theirs;
+# Qwen2VLSdpaAttention already passes enable_gqa to SDPA and keeps its forward
+GROUPED_FORWARDS = {
+    "Qwen2VLAttention": grouped_attention_forward,
+    "Qwen2VLFlashAttention2": grouped_flash_attention_forward,
+}
+
+
+def install_grouped_attention(model):
+    """Stop the eager and flash-attention-2 text attention from copying K/V heads with ``repeat_kv``.
+
+    Qwen2-VL attention blocks get a grouped forward bound to the instance. Qwen2
+    (text-only) blocks look ``eager_attention_forward`` up in the globals of
+    their forward (the unsloth-compiled module once unsloth has patched the
+    class), so it is replaced there. Returns the number of blocks patched.
+    """
+    patched = 0
+    for module in model.modules():
+        name = type(module).__name__
+        if name in GROUPED_FORWARDS:
+            bind_forward(module, GROUPED_FORWARDS[name])
+            patched += 1
+        elif name == "Qwen2Attention":
+            inspect.unwrap(type(module).forward).__globals__["eager_attention_forward"] = eager_attention_forward
+            patched += 1
+    return patched
@@ -1,14 +1,54 @@
-
-
 from unsloth import FastLanguageModel
 from PIL import Image
-from transformers import TextStreamer
+from transformers import BatchFeature, TextStreamer
 import torch
+import warnings
+from .quantized_checkpoint import check_versions, read_marker
+from .rope_cache import RopeTables, install_rope_cache, text_rope_cached
+from .rope_index import RopeIndexCache, find_rope_index_owner, install_rope_index_cache
+from .vision_cache import VisionFeatureCache, install_vision_cache
+from .gqa_attention import install_grouped_attention
+from .norms import install_rms_norm
+from .last_logits import accepts_logits_to_keep, find_lm_head_owner, install_last_logits
+from .vision_attention import install_varlen_vision_attention
+from .patching import check_patches
+from .streaming import CallbackStreamer
+
+FOLLOW_UP_QUESTION = 'Kết luận từ thông tin đó bệnh nhân bị gì?, Hãy nói chi tiết.'
+# report layout; streamed to clients as section markers between the two turns
+FINDINGS_HEADER = "##  Nhận xét hình ảnh:\n\n"
+CONCLUSION_HEADER = "\n\n---\n\n##  Kết luận:\n\n"
+
+
+class PreparedImage:
+    """An image with its Qwen2-VL pixel patches already computed.
+
+    Built by ``ClaraPipeline.preprocess_image`` so normalisation and patch extraction
+    can run on a preprocessing thread instead of the generation thread; accepted
+    wherever the pipeline takes an image.
+    """
+
+    def __init__(self, image, features):
+        self.image = image
+        self.features = features  # pixel_values, image_grid_thw
+
 
 class ClaraPipeline:
-    def __init__(self, model_path, max_seq_length=1024, max_tokens= 512):
+    findings_header = FINDINGS_HEADER
+    conclusion_header = CONCLUSION_HEADER
+
+    def __init__(self, model_path, max_seq_length=1024, max_tokens= 512, reuse_kv_cache=True,
+                 vision_cache_bytes=256 * 1024 * 1024, vision_cache_dir=None):
         self.max_seq_length = max_seq_length
         self.max_tokens= max_tokens
+        self.reuse_kv_cache = reuse_kv_cache
+        # a checkpoint from quantized_checkpoint.py already holds 4-bit weights and their
+        # quant state: they are memory-mapped and used as is instead of re-quantized
+        marker = read_marker(model_path)
+        self.load_format = "prequantized" if marker else "quantize-on-load"
+        if marker:
+            for warning in check_versions(marker):
+                warnings.warn(f"{model_path}: {warning}")
         self.model, self.tokenizer = FastLanguageModel.from_pretrained(
             model_name=model_path,
             max_seq_length=max_seq_length,
@@ -17,50 +57,246 @@ class ClaraPipeline:
             # dtype= torch.bfloat16
         )
         FastLanguageModel.for_inference(self.model)  # enable 2x inference speed
+        # batched prompts are left padded so every row ends where generation starts
+        self.tokenizer.tokenizer.padding_side = "left"
+        # repeated images skip the vision tower
+        self.vision_cache = None
+        if vision_cache_bytes:
+            self.vision_cache = install_vision_cache(
+                self.model, VisionFeatureCache(max_bytes=vision_cache_bytes, disk_dir=vision_cache_dir)
+            )
+        # rotary cos/sin come from precomputed tables instead of being recomputed every forward
+        self.rope_tables = install_rope_cache(self.model, RopeTables(max_positions=max_seq_length))
+        if not text_rope_cached(self.model):
+            raise RuntimeError("the text rotary embedding the model calls is not served from the rope tables")
+        # 3-D position ids are copied from the prompt's layout instead of rebuilt token by token
+        self.rope_index_cache = install_rope_index_cache(self.model, RopeIndexCache())
+        # holds the rope_deltas of the last prefill, which follow-up turns restore before reusing a cache
+        self.rope_index_owner = find_rope_index_owner(self.model)
+        # vision attention runs per image instead of over a dense [patches, patches] mask
+        # (flash-attention-2 vision blocks are already varlen and are left alone)
+        expected = ["vision_varlen_attention"] if install_varlen_vision_attention(self.model) else []
+        # eager and flash-attention-2 text attention read shared K/V heads in place instead of repeat_kv copies
+        if install_grouped_attention(self.model):
+            expected.append("grouped_kv_attention")
+        # prefill projects only the positions that get sampled through lm_head
+        if install_last_logits(self.model):
+            expected.append("last_logits")
+        # unsloth's generated nn.RMSNorm forward fails on every call; Qwen2-VL's own norms are not nn.RMSNorm
+        if install_rms_norm(self.model):
+            expected.append("rms_norm")
+        self.patches = check_patches(self.model, expected)
+        if not accepts_logits_to_keep(find_lm_head_owner(self.model)):
+            raise RuntimeError("the loaded forward does not accept logits_to_keep")
+
 
+    def warm_up(self, image=None, max_new_tokens=8):
+        """Short generation on a blank image so compilation and CUDA setup happen before the first request."""
+        image = image if image is not None else Image.new("RGB", (448, 448))
+        conversation = self.build_conversation(image, FOLLOW_UP_QUESTION)
+        inputs = self.prepare_inputs(conversation, image).to(self.model.device)
+        self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+
+    def preprocess_image(self, image):
+        """Run the image processor (resize, normalise, patchify) ahead of generation."""
+        if isinstance(image, PreparedImage):
+            return image
+        return PreparedImage(image, self.tokenizer.image_processor(images=[image], return_tensors="pt"))
+
+    def _encode_prepared(self, prompts, images, **kwargs):
+        """Tokenizer half of the processor call for images whose patches are already computed."""
+        image_token = self.tokenizer.image_token
+        merge_length = self.tokenizer.image_processor.merge_size ** 2
+        # same placeholder expansion as the processor: one token per merged patch
+        prompts = [
+            prompt.replace(image_token, image_token * (int(image.features["image_grid_thw"].prod()) // merge_length), 1)
+            for prompt, image in zip(prompts, images)
+        ]
+        text_inputs = self.tokenizer.tokenizer(prompts, add_special_tokens=False, return_tensors="pt", **kwargs)
+        return BatchFeature({
+            **text_inputs,
+            "pixel_values": torch.cat([image.features["pixel_values"] for image in images]),
+            "image_grid_thw": torch.cat([image.features["image_grid_thw"] for image in images]),
+        })
 
-    def _generate_response(self, conversation, image):
+    def prepare_inputs(self, conversation, image):
+        """Template and tokenize one conversation with its image; tensors stay on the CPU."""
         prompt = self.tokenizer.apply_chat_template(
             conversation, tokenize=False, add_generation_prompt=True
         )
+        if isinstance(image, PreparedImage):
+            return self._encode_prepared([prompt], [image])
 
-        inputs = self.tokenizer(
+        return self.tokenizer(
             image,
             prompt,
             add_special_tokens=False,
             return_tensors="pt",
-        ).to("cuda")
+        )
+
+    def _streamer(self, on_event=None):
+        if on_event is not None:
+            return CallbackStreamer(self.tokenizer, on_event, skip_prompt=True)
+        return TextStreamer(self.tokenizer, skip_prompt=True)
+
+    def _generate_response(self, conversation, image, return_state=False, on_event=None):
+        inputs = self.prepare_inputs(conversation, image).to(self.model.device)
+
+        streamer = self._streamer(on_event)
+        outputs = self.model.generate(
+            **inputs, streamer=streamer, max_new_tokens=self.max_tokens,
+            return_dict_in_generate=True,
+        )
+
+        trimmed = [out[len(inp):] for inp, out in zip(inputs.input_ids, outputs.sequences)]
+        response = self.tokenizer.batch_decode(
+            trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )[0]
+        if return_state:
+            return response, (inputs, outputs, self.rope_index_owner.rope_deltas)
+        return response
+
+    def _follow_up_suffix(self, conversation, response_1):
+        """Template text that the follow-up turn adds after ``response_1``, or None if it cannot be isolated."""
+        prompt_1 = self.tokenizer.apply_chat_template(
+            conversation[:1], tokenize=False, add_generation_prompt=True
+        )
+        prompt_2 = self.tokenizer.apply_chat_template(
+            conversation, tokenize=False, add_generation_prompt=True
+        )
+        prefix = prompt_1 + response_1
+        if not prompt_2.startswith(prefix):
+            return None
+        return prompt_2[len(prefix):]
 
-        streamer = TextStreamer(self.tokenizer, skip_prompt=True)
+    def _generate_follow_up(self, conversation, response_1, state, on_event=None):
+        """Second turn on top of the turn-1 KV cache: only the follow-up tokens are prefilled.
+
+        Returns None when the turn-1 cache cannot be reused, so the caller falls back
+        to re-templating the whole conversation.
+        """
+        inputs, outputs, rope_deltas = state
+        past_key_values = getattr(outputs, "past_key_values", None)
+        suffix = self._follow_up_suffix(conversation, response_1)
+        if past_key_values is None or suffix is None:
+            return None
+
+        sequences = outputs.sequences
+        eos = self.model.generation_config.eos_token_id
+        eos = {eos} if isinstance(eos, int) else set(eos or [])
+        # The cache covers every token but the last one generated. A final EOS is
+        # dropped here because the template suffix closes the assistant turn itself.
+        if int(sequences[0, -1]) in eos:
+            sequences = sequences[:, :-1]
+
+        suffix_ids = self.tokenizer.tokenizer(
+            suffix, add_special_tokens=False, return_tensors="pt"
+        ).input_ids.to(sequences.device)
+        input_ids = torch.cat([sequences, suffix_ids], dim=1)
+
+        # The suffix is prefilled at a nonzero cache position, where the model offsets
+        # positions by its stored rope_deltas instead of recomputing them; set turn 1's
+        # explicitly rather than rely on whatever ran on the model since.
+        self.rope_index_owner.rope_deltas = rope_deltas
+        streamer = self._streamer(on_event)
         generated_ids = self.model.generate(
-            **inputs, streamer=streamer, max_new_tokens=self.max_tokens
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            pixel_values=inputs.pixel_values,
+            image_grid_thw=inputs.image_grid_thw,
+            past_key_values=past_key_values,
+            streamer=streamer,
+            max_new_tokens=self.max_tokens,
         )
 
-        trimmed = [out[len(inp):] for inp, out in zip(inputs.input_ids, generated_ids)]
         return self.tokenizer.batch_decode(
-            trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+            generated_ids[:, input_ids.shape[1]:], skip_special_tokens=True, clean_up_tokenization_spaces=False
         )[0]
 
-    def run(self, image, follow_up_question):
-        conversation = []
+    def _generate_batch(self, conversations, images):
+        """Run one left-padded ``model.generate`` over several conversations."""
+        prompts = [
+            self.tokenizer.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
+            for conversation in conversations
+        ]
 
-        # Step 1: First question with image
-        conversation.append({
+        if all(isinstance(image, PreparedImage) for image in images):
+            inputs = self._encode_prepared(prompts, images, padding=True)
+        else:
+            inputs = self.tokenizer(
+                [getattr(image, "image", image) for image in images],
+                prompts,
+                add_special_tokens=False,
+                padding=True,
+                return_tensors="pt",
+            )
+        inputs = inputs.to(self.model.device)
+
+        generated_ids = self.model.generate(**inputs, max_new_tokens=self.max_tokens)
+
+        # left padding aligns every prompt to the same length
+        trimmed = generated_ids[:, inputs.input_ids.shape[1]:]
+        return self.tokenizer.batch_decode(
+            trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )
+
+    @staticmethod
+    def build_conversation(image, question):
+        return [{
             "role": "user",
             "content": [
-                {"type": "text", "text": follow_up_question},
+                {"type": "text", "text": question},
                 {"type": "image", "image": image}
             ]
-        })
-        response_1 = self._generate_response(conversation, image)
-        conversation.append({"role": "assistant", "content": [{"type": "text", "text": response_1}]})
+        }]
 
-        # Step 2: Follow-up question
+    @staticmethod
+    def add_follow_up(conversation, response_1):
+        conversation.append({"role": "assistant", "content": [{"type": "text", "text": response_1}]})
         conversation.append({
             "role": "user",
-            "content": [{"type": "text", "text": 'Kết luận từ thông tin đó bệnh nhân bị gì?, Hãy nói chi tiết.'}]
+            "content": [{"type": "text", "text": FOLLOW_UP_QUESTION}]
         })
-        response_2 = self._generate_response(conversation, image)
-        output = f"##  Nhận xét hình ảnh:\n\n{response_1}\n\n---\n\n##  Kết luận:\n\n{response_2}"
+        return conversation
+
+    @staticmethod
+    def format_report(response_1, response_2):
+        return f"{FINDINGS_HEADER}{response_1}{CONCLUSION_HEADER}{response_2}"
+
+    def run(self, image, follow_up_question, on_event=None):
+        """Two-turn report. With ``on_event`` set, tokens are streamed to it as they are generated.
+
+        ``on_event(kind, payload)`` receives ``("section", header)`` before each turn,
+        then ``("text", chunk)`` and ``("tokens", n)`` events from ``CallbackStreamer``.
+        """
+        emit = on_event or (lambda kind, payload: None)
+
+        # Step 1: First question with image
+        conversation = self.build_conversation(image, follow_up_question)
+        emit("section", FINDINGS_HEADER)
+        response_1, state = self._generate_response(conversation, image, return_state=True, on_event=on_event)
+
+        # Step 2: Follow-up question, reusing the turn-1 KV cache when possible
+        self.add_follow_up(conversation, response_1)
+        emit("section", CONCLUSION_HEADER)
+        response_2 = None
+        if self.reuse_kv_cache:
+            response_2 = self._generate_follow_up(conversation, response_1, state, on_event=on_event)
+        if response_2 is None:
+            response_2 = self._generate_response(conversation, image, on_event=on_event)
+
+        return self.format_report(response_1, response_2)
+
+    def run_batch(self, images, questions):
+        """Batched equivalent of ``run``: both turns are generated for all requests at once."""
+        if len(images) == 1:
+            # a batch of one takes the KV-cache reusing path
+            return [self.run(images[0], questions[0])]
+        conversations = [self.build_conversation(image, question) for image, question in zip(images, questions)]
+        responses_1 = self._generate_batch(conversations, images)
+
+        for conversation, response_1 in zip(conversations, responses_1):
+            self.add_follow_up(conversation, response_1)
+        responses_2 = self._generate_batch(conversations, images)
 
-        return output
+        return [self.format_report(r1, r2) for r1, r2 in zip(responses_1, responses_2)]
@@ -0,0 +1,59 @@
+import inspect
+import threading
+
+from .patching import bind_forward, patch
+
+
+def find_lm_head_owner(model):
+    """Return the module of ``model`` whose forward applies ``lm_head`` (plain, composite or PEFT wrapped)."""
+    for module in model.modules():
+        if getattr(module, "lm_head", None) is not None:
+            return module
+    raise AttributeError(f"{type(model).__name__} has no lm_head")
+
+
+def accepts_logits_to_keep(module):
+    return "logits_to_keep" in inspect.signature(module.forward).parameters
+
+
+def install_last_logits(model):
+    """Make the model's forward take ``logits_to_keep`` when its loaded forward does not.
+
+    The unsloth-generated ``Qwen2VLForConditionalGeneration.forward`` has no
+    ``logits_to_keep``: ``generate`` then leaves it out and the full prompt goes
+    through the ~152k-entry ``lm_head`` at every prefill, and an explicit
+    ``logits_to_keep=1`` would land silently in ``**loss_kwargs``. The wrapper
+    bound here takes the argument and has ``lm_head`` project only the kept
+    positions when there are no labels. Returns whether a wrapper was bound.
+    """
+    owner = find_lm_head_owner(model)
+    if accepts_logits_to_keep(owner):
+        return False
+    keep = threading.local()
+    forward = owner.forward
+    lm_head_forward = owner.lm_head.forward
+
+    def last_logits_lm_head(self, hidden_states):
+        logits_to_keep = getattr(keep, "value", 0)
+        if isinstance(logits_to_keep, int):
+            if logits_to_keep:
+                hidden_states = hidden_states[:, -logits_to_keep:, :]
+        else:
+            hidden_states = hidden_states[:, logits_to_keep, :]
+        return lm_head_forward(hidden_states)
+
+    @patch("last_logits")
+    def last_logits_forward(self, *args, logits_to_keep=0, **kwargs):
+        """The loaded forward, with ``lm_head`` applied to the last ``logits_to_keep`` positions (all if ``0``)
+        or to the sequence indices in a 1D tensor; ignored when ``labels`` are given."""
+        if kwargs.get("labels") is not None:
+            logits_to_keep = 0
+        keep.value = logits_to_keep
+        try:
+            return forward(*args, **kwargs)
+        finally:
+            keep.value = 0
+
+    bind_forward(owner.lm_head, last_logits_lm_head)
+    bind_forward(owner, last_logits_forward)
+    return True
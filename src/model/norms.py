@@ -0,0 +1,26 @@
+import torch.nn.functional as F
+from torch import nn
+
+from .patching import bind_forward, patch
+
+
+@patch("rms_norm")
+def rms_norm_forward(self, x):
+    """``nn.RMSNorm.forward`` as unsloth generates it in ``RMSNorm.py``, casting with ``x.dtype``.
+
+    The generated version casts with ``input.dtype``, where ``input`` is Python's
+    builtin rather than the tensor, so it raises ``AttributeError`` on every call.
+    Qwen2-VL has no ``nn.RMSNorm`` (its ``Qwen2RMSNorm`` forward is already
+    compiled into one fused kernel), so on Clara this binds nothing.
+    """
+    return F.rms_norm(x, self.normalized_shape, self.weight, self.eps).to(x.dtype)
+
+
+def install_rms_norm(model):
+    """Bind the working forward to every ``nn.RMSNorm`` of ``model``; returns how many there are."""
+    patched = 0
+    for module in model.modules():
+        if isinstance(module, nn.RMSNorm):
+            bind_forward(module, rms_norm_forward)
+            patched += 1
+    return patched
@@ -0,0 +1,64 @@
+"""Forward patches bound to the loaded model's module instances.
+
+``unsloth_compiled_cache/`` is generated by unsloth_zoo, and ``FastLanguageModel``
+rewrites it whenever its content differs from what it would generate, so
+changes to those files do not survive a load. Clara's attention, norm and
+logits optimisations are therefore applied after load: ``bind_forward`` sets an
+instance-level ``forward`` tagged with the patch name, and ``check_patches``
+confirms each expected patch is what the model actually calls.
+"""
+import inspect
+import types
+from collections import Counter
+
+# module-level functions that patches may replace, and the classes whose forward looks them up
+PATCHED_GLOBALS = {"eager_attention_forward": ("Qwen2Attention",)}
+
+
+def patch(name):
+    """Tag a forward function with the patch ``name`` it implements."""
+
+    def decorate(forward):
+        forward.clara_patch = name
+        return forward
+
+    return decorate
+
+
+def bind_forward(module, forward):
+    module.forward = types.MethodType(forward, module)
+
+
+def _tag(fn):
+    return getattr(getattr(fn, "__func__", fn), "clara_patch", None)
+
+
+def bound_patch(module):
+    """Name of the patch bound as ``module``'s instance forward, or None."""
+    return _tag(module.__dict__.get("forward"))
+
+
+def bound_patches(model):
+    """Number of modules of ``model`` that run each tagged patch.
+
+    A module counts when its instance ``forward`` is a patch, or when a global
+    in ``PATCHED_GLOBALS`` that its class forward calls has been replaced by one.
+    """
+    counts = Counter()
+    for module in model.modules():
+        name = bound_patch(module)
+        for global_name, classes in PATCHED_GLOBALS.items():
+            if name is None and type(module).__name__ in classes:
+                name = _tag(inspect.unwrap(type(module).forward).__globals__.get(global_name))
+        if name is not None:
+            counts[name] += 1
+    return dict(counts)
+
+
+def check_patches(model, expected):
+    """Raise unless every patch in ``expected`` is bound to at least one module; returns the counts."""
+    counts = bound_patches(model)
+    missing = [name for name in expected if not counts.get(name)]
+    if missing:
+        raise RuntimeError(f"patches not bound after load: {', '.join(missing)} (bound: {counts})")
+    return counts
@@ -0,0 +1,92 @@
+"""Export Clara as a pre-quantized 4-bit safetensors checkpoint.
+
+    python -m src.model.quantized_checkpoint --model-path /path/to/model_hf_cached --output /path/to/clara-bnb-4bit
+
+Loading the full-precision snapshot with ``load_in_4bit=True`` reads every bf16
+weight and quantizes it again on each start. The exported directory holds the
+already-quantized weights with their bitsandbytes quant state (absmax, quant map,
+nested statistics) in safetensors shards, which are memory-mapped on load. The
+config's ``quantization_config`` tells ``from_pretrained`` to use them as is.
+``ClaraPipeline`` recognises the directory by its marker file.
+"""
+import argparse
+import json
+import os
+import time
+
+MARKER_FILE = "clara_quantized.json"
+FORMAT = "bnb-4bit-safetensors"
+
+
+def read_marker(model_path):
+    """Marker of an exported checkpoint, or None for any other model path."""
+    path = os.path.join(model_path, MARKER_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        marker = json.load(f)
+    if marker.get("format") != FORMAT:
+        raise ValueError(f"{path}: unknown checkpoint format {marker.get('format')!r}")
+    return marker
+
+
+def check_versions(marker):
+    """Warnings for library versions that differ from the ones the checkpoint was written with."""
+    import bitsandbytes
+    import transformers
+
+    warnings = []
+    for name, module in (("bitsandbytes", bitsandbytes), ("transformers", transformers)):
+        saved = marker.get("versions", {}).get(name)
+        if saved and saved.split(".")[:2] != module.__version__.split(".")[:2]:
+            warnings.append(f"checkpoint written with {name} {saved}, running {module.__version__}")
+    return warnings
+
+
+def export(model_path, output, max_seq_length=1024, max_shard_size="2GB"):
+    import bitsandbytes
+    import transformers
+    from unsloth import FastLanguageModel
+
+    started = time.perf_counter()
+    model, processor = FastLanguageModel.from_pretrained(
+        model_name=model_path,
+        max_seq_length=max_seq_length,
+        load_in_4bit=True,
+    )
+    quantized_s = time.perf_counter() - started
+
+    os.makedirs(output, exist_ok=True)
+    model.save_pretrained(output, safe_serialization=True, max_shard_size=max_shard_size)
+    processor.save_pretrained(output)
+
+    marker = {
+        "format": FORMAT,
+        "source": os.path.abspath(model_path),
+        "max_seq_length": max_seq_length,
+        "quantization_config": model.config.quantization_config.to_dict(),
+        "versions": {"bitsandbytes": bitsandbytes.__version__, "transformers": transformers.__version__},
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    # written last: a directory without the marker is an incomplete export
+    with open(os.path.join(output, MARKER_FILE), "w", encoding="utf-8") as f:
+        json.dump(marker, f, indent=2)
+
+    size = sum(
+        os.path.getsize(os.path.join(output, name)) for name in os.listdir(output) if name.endswith(".safetensors")
+    )
+    print(f"quantized in {quantized_s:.1f}s, wrote {size / 2**30:.2f} GiB of safetensors to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model-path", required=True, help="full-precision snapshot")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--max-seq-length", type=int, default=1024)
+    parser.add_argument("--max-shard-size", default="2GB")
+    args = parser.parse_args()
+    export(args.model_path, args.output, args.max_seq_length, args.max_shard_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import math
+
+from PIL import Image
+
+# Qwen2-VL: 14-pixel patches merged 2x2, so one visual token per 28x28 pixel cell
+PATCH_GRID = 28
+TOKEN_PIXELS = PATCH_GRID * PATCH_GRID
+# smart_resize rejects images more elongated than this; they are squeezed to it instead
+MAX_ASPECT_RATIO = 200
+
+
+class ResolutionPolicy:
+    """Aspect-preserving resize onto the 28-pixel grid within a visual-token budget.
+
+    Same rounding as Qwen2-VL's ``smart_resize``: each side is snapped to a multiple
+    of 28, then scaled down (or up) until the area is within ``[min_pixels, max_pixels]``.
+    Unlike ``smart_resize``, an aspect ratio above ``MAX_ASPECT_RATIO`` is capped
+    rather than rejected, and since no side goes below 28 pixels, the long side of
+    a very elongated image is shortened further to stay within ``max_pixels``.
+    """
+
+    def __init__(self, name, min_pixels, max_pixels):
+        self.name = name
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+
+    def target_size(self, width, height):
+        """``(width, height)`` an image of this size is resized to."""
+        if width > MAX_ASPECT_RATIO * height:
+            width = MAX_ASPECT_RATIO * height
+        elif height > MAX_ASPECT_RATIO * width:
+            height = MAX_ASPECT_RATIO * width
+        h_bar = max(PATCH_GRID, round(height / PATCH_GRID) * PATCH_GRID)
+        w_bar = max(PATCH_GRID, round(width / PATCH_GRID) * PATCH_GRID)
+        if h_bar * w_bar > self.max_pixels:
+            beta = math.sqrt(height * width / self.max_pixels)
+            h_bar = max(PATCH_GRID, math.floor(height / beta / PATCH_GRID) * PATCH_GRID)
+            w_bar = max(PATCH_GRID, math.floor(width / beta / PATCH_GRID) * PATCH_GRID)
+        elif h_bar * w_bar < self.min_pixels:
+            beta = math.sqrt(self.min_pixels / (height * width))
+            h_bar = math.ceil(height * beta / PATCH_GRID) * PATCH_GRID
+            w_bar = math.ceil(width * beta / PATCH_GRID) * PATCH_GRID
+        if h_bar * w_bar > self.max_pixels:
+            # the short side was clamped to one cell, which pushed the area over the budget again
+            if h_bar > w_bar:
+                h_bar = max(PATCH_GRID, self.max_pixels // w_bar // PATCH_GRID * PATCH_GRID)
+            else:
+                w_bar = max(PATCH_GRID, self.max_pixels // h_bar // PATCH_GRID * PATCH_GRID)
+        return w_bar, h_bar
+
+    def visual_tokens(self, width, height):
+        w_bar, h_bar = self.target_size(width, height)
+        return (w_bar // PATCH_GRID) * (h_bar // PATCH_GRID)
+
+    def apply(self, image):
+        size = self.target_size(*image.size)
+        if size == image.size:
+            return image
+        return image.resize(size, Image.BICUBIC)
+
+    def __repr__(self):
+        return f"ResolutionPolicy({self.name!r}, min_pixels={self.min_pixels}, max_pixels={self.max_pixels})"
+
+
+PROFILES = {
+    # triage: a quarter of the default visual tokens
+    "fast": ResolutionPolicy("fast", min_pixels=16 * TOKEN_PIXELS, max_pixels=64 * TOKEN_PIXELS),
+    # same budget as the former fixed 448x448 resize (256 tokens), keeping the aspect ratio
+    "default": ResolutionPolicy("default", min_pixels=64 * TOKEN_PIXELS, max_pixels=256 * TOKEN_PIXELS),
+    "detail": ResolutionPolicy("detail", min_pixels=256 * TOKEN_PIXELS, max_pixels=1024 * TOKEN_PIXELS),
+}
+
+
+def get_policy(name):
+    """Profile by name; raises ``ValueError`` for unknown names."""
+    try:
+        return PROFILES[(name or "default").lower()]
+    except KeyError:
+        raise ValueError(f"Unknown resolution profile: {name} (expected one of {', '.join(PROFILES)})")
@@ -0,0 +1,134 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+from .patching import bound_patch, patch
+from .vision_cache import find_visual
+
+
+def find_text_rotary(model):
+    """Return the rotary embedding the language model calls for its position embeddings.
+
+    That is the ``rotary_emb`` of the decoder owning ``embed_tokens`` and
+    ``layers``. Each ``Qwen2VLAttention`` also builds a ``rotary_emb`` of its
+    own, but never calls it: attention gets the decoder's cos/sin instead.
+    """
+    for module in model.modules():
+        rotary = getattr(module, "rotary_emb", None)
+        if hasattr(module, "embed_tokens") and hasattr(module, "layers") and hasattr(rotary, "inv_freq"):
+            return rotary
+    raise AttributeError(f"{type(model).__name__} has no text rotary embedding")
+
+
+def text_rope_cached(model):
+    """Whether the rotary embedding the language model calls is served from ``RopeTables``."""
+    return bound_patch(find_text_rotary(model)) == "rope_cache"
+
+
+class RopeTables:
+    """Precomputed rotary cos/sin tables, so requests index into them instead of recomputing.
+
+    Text: one ``[max_positions, head_dim]`` cos and sin table per device and dtype;
+    positions beyond it fall back to the model's own computation. Vision: the
+    rotary embedding of each image grid ``(t, h, w)``, in an LRU of ``max_grids``.
+    """
+
+    def __init__(self, max_positions=1024, max_grids=64):
+        self.max_positions = max_positions
+        self.max_grids = max_grids
+        self._text = {}
+        self._grids = OrderedDict()
+        self._lock = threading.Lock()
+        self.text_hits = 0
+        self.text_misses = 0
+        self.grid_hits = 0
+        self.grid_misses = 0
+
+    def text_tables(self, rotary, device, dtype):
+        key = (device, dtype)
+        with self._lock:
+            tables = self._text.get(key)
+        if tables is None:
+            # same float32 math as Qwen2VLRotaryEmbedding, done once for every position
+            positions = torch.arange(self.max_positions, device=device, dtype=torch.float32)
+            freqs = torch.outer(positions, rotary.inv_freq.to(device=device, dtype=torch.float32))
+            emb = torch.cat((freqs, freqs), dim=-1)
+            tables = (
+                (emb.cos() * rotary.attention_scaling).to(dtype),
+                (emb.sin() * rotary.attention_scaling).to(dtype),
+            )
+            with self._lock:
+                self._text[key] = tables
+        return tables
+
+    def text(self, rotary, x, position_ids):
+        """``(cos, sin)`` for 3-D mrope ``position_ids``, or None when a position is past the table."""
+        if int(position_ids.max()) >= self.max_positions or int(position_ids.min()) < 0:
+            with self._lock:
+                self.text_misses += 1
+            return None
+        cos, sin = self.text_tables(rotary, x.device, x.dtype)
+        with self._lock:
+            self.text_hits += 1
+        return cos[position_ids], sin[position_ids]
+
+    def grid(self, key, compute):
+        with self._lock:
+            emb = self._grids.get(key)
+            if emb is not None:
+                self._grids.move_to_end(key)
+                self.grid_hits += 1
+                return emb
+            self.grid_misses += 1
+        emb = compute()
+        with self._lock:
+            self._grids[key] = emb
+            while len(self._grids) > self.max_grids:
+                self._grids.popitem(last=False)
+        return emb
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_positions": self.max_positions,
+                "text_tables": len(self._text),
+                "text_hits": self.text_hits,
+                "text_misses": self.text_misses,
+                "grids": len(self._grids),
+                "max_grids": self.max_grids,
+                "grid_hits": self.grid_hits,
+                "grid_misses": self.grid_misses,
+            }
+
+
+def install_rope_cache(model, tables):
+    """Serve the text rotary embedding and the vision tower's ``rot_pos_emb`` from ``tables``.
+
+    Only the default (unscaled) rope type is cached for text, since dynamic
+    variants change ``inv_freq`` with the sequence length.
+    """
+    rotary = find_text_rotary(model)
+    if getattr(rotary, "rope_type", "default") == "default":
+        compute_text = rotary.forward
+
+        @patch("rope_cache")
+        def cached_text_forward(x, position_ids):
+            cached = tables.text(rotary, x, position_ids)
+            return cached if cached is not None else compute_text(x, position_ids)
+
+        rotary.forward = cached_text_forward
+
+    visual = find_visual(model)
+    compute_grid = visual.rot_pos_emb
+
+    def cached_rot_pos_emb(grid_thw):
+        # per image, so a batch mixing known and new grid sizes only computes the new ones
+        embs = [
+            tables.grid((tuple(grid), str(grid_thw.device)), lambda: compute_grid(grid_thw[i : i + 1]))
+            for i, grid in enumerate(grid_thw.tolist())
+        ]
+        return embs[0] if len(embs) == 1 else torch.cat(embs)
+
+    visual.rot_pos_emb = cached_rot_pos_emb
+    return tables
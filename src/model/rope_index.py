@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def find_rope_index_owner(model):
+    """Return the module whose ``get_rope_index`` builds Qwen2-VL's 3-D position ids."""
+    for module in model.modules():
+        if hasattr(module, "get_rope_index") and hasattr(module, "rope_deltas"):
+            return module
+    raise AttributeError(f"{type(model).__name__} has no get_rope_index")
+
+
+def layout_positions(length, blocks, device):
+    """``[3, length]`` mrope positions of one unpadded prompt.
+
+    ``blocks`` holds ``(start, t, h, w)`` for each vision block, with ``h`` and
+    ``w`` already divided by the spatial merge size. Text runs count up by one on
+    all three axes; a vision block gets its (t, h, w) grid offsets on top of the
+    position after the preceding text, and the text after it resumes one past
+    the block's largest position. Work is per block, not per token.
+    """
+    pieces = []
+    st = 0
+    next_pos = 0
+    for start, t, h, w in blocks:
+        text_len = start - st
+        pieces.append(torch.arange(next_pos, next_pos + text_len, device=device).expand(3, -1))
+        grid = torch.stack(
+            [
+                torch.arange(t, device=device).view(-1, 1, 1).expand(t, h, w),
+                torch.arange(h, device=device).view(1, -1, 1).expand(t, h, w),
+                torch.arange(w, device=device).view(1, 1, -1).expand(t, h, w),
+            ]
+        ).reshape(3, -1)
+        pieces.append(grid + next_pos + text_len)
+        next_pos += text_len + max(t, h, w)
+        st = start + t * h * w
+    pieces.append(torch.arange(next_pos, next_pos + length - st, device=device).expand(3, -1))
+    return torch.cat(pieces, dim=1), next_pos + length - st
+
+
+class RopeIndexCache:
+    """Position-id patterns keyed by prompt layout: unpadded length plus each vision block's start and grid.
+
+    Clara's prompts come in a few fixed layouts (chat template, one image block,
+    question), so after the first request of a layout its positions are a copy.
+    Bounded LRU of ``max_layouts`` entries.
+    """
+
+    def __init__(self, max_layouts=256):
+        self.max_layouts = max_layouts
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, device):
+        """``(positions, next_position)`` for a layout, building it on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        length, blocks, _ = key
+        entry = layout_positions(length, blocks, device)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_layouts:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "layouts": len(self._entries),
+                "max_layouts": self.max_layouts,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def install_rope_index_cache(model, cache):
+    """Replace ``get_rope_index`` with a vectorised, layout-cached version.
+
+    Same results as transformers' implementation: padding positions are 1 and
+    ``rope_deltas`` is measured against the padded length. Text-only inputs go
+    to the original, which is already vectorised.
+    """
+    owner = find_rope_index_owner(model)
+    compute = owner.get_rope_index
+    config = owner.config
+    merge = config.vision_config.spatial_merge_size
+    vision_ids = (config.image_token_id, config.video_token_id)
+
+    def cached_get_rope_index(input_ids=None, image_grid_thw=None, video_grid_thw=None, attention_mask=None):
+        if input_ids is None or (image_grid_thw is None and video_grid_thw is None):
+            return compute(input_ids, image_grid_thw, video_grid_thw, attention_mask)
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        valid = attention_mask == 1
+        is_vision = ((input_ids == vision_ids[0]) | (input_ids == vision_ids[1])) & valid
+        # first token of every run of vision tokens, in reading order across the batch
+        previous = torch.cat([torch.zeros_like(is_vision[:, :1]), is_vision[:, :-1]], dim=1)
+        run_starts = is_vision & ~previous
+        rows, starts = run_starts.nonzero(as_tuple=True)
+        # index of each run start among the row's unpadded tokens
+        offsets = (valid.cumsum(-1) - 1)[rows, starts].tolist()
+        kinds = (input_ids[rows, starts] == vision_ids[0]).tolist()
+        lengths = valid.sum(-1).tolist()
+        images = iter(image_grid_thw.tolist() if image_grid_thw is not None else ())
+        videos = iter(video_grid_thw.tolist() if video_grid_thw is not None else ())
+
+        blocks = [[] for _ in lengths]
+        for row, offset, is_image in zip(rows.tolist(), offsets, kinds):
+            t, h, w = next(images) if is_image else next(videos)
+            blocks[row].append((offset, t, h // merge, w // merge))
+
+        position_ids = torch.ones(3, *input_ids.shape, dtype=input_ids.dtype, device=input_ids.device)
+        deltas = []
+        for row, length in enumerate(lengths):
+            positions, next_pos = cache.get((length, tuple(blocks[row]), str(input_ids.device)), input_ids.device)
+            position_ids[:, row, valid[row]] = positions.to(input_ids.dtype)
+            deltas.append(next_pos - input_ids.shape[1])
+        return position_ids, torch.tensor(deltas, device=input_ids.device).unsqueeze(1)
+
+    owner.get_rope_index = cached_get_rope_index
+    return cache
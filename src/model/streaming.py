@@ -0,0 +1,23 @@
+from transformers import TextStreamer
+
+
+class CallbackStreamer(TextStreamer):
+    """``TextStreamer`` that hands decoded text to a callback instead of printing it.
+
+    ``on_event(kind, payload)`` receives ``("tokens", n)`` for every batch of new
+    token ids and ``("text", chunk)`` for every finalized piece of text.
+    """
+
+    def __init__(self, tokenizer, on_event, skip_prompt=True, **decode_kwargs):
+        decode_kwargs.setdefault("skip_special_tokens", True)
+        super().__init__(tokenizer, skip_prompt=skip_prompt, **decode_kwargs)
+        self.on_event = on_event
+
+    def put(self, value):
+        if not (self.skip_prompt and self.next_tokens_are_prompt):
+            self.on_event("tokens", int(value.numel()))
+        super().put(value)
+
+    def on_finalized_text(self, text, stream_end=False):
+        if text:
+            self.on_event("text", text)
@@ -0,0 +1,74 @@
+import math
+
+import torch
+import torch.nn.functional as F
+from transformers.models.qwen2_vl.modeling_qwen2_vl import apply_rotary_pos_emb_vision
+
+from .patching import bind_forward, patch
+from .vision_cache import find_visual
+
+# vision attention classes that build a dense [seq, seq] mask, and whether they use eager math
+VARLEN_CLASSES = {"VisionAttention": True, "VisionSdpaAttention": False}
+
+
+@torch.compiler.disable(recursive=False)
+def vision_varlen_attention(q, k, v, cu_seqlens, eager=False):
+    """Attention within each ``cu_seqlens`` segment (one image or frame), without a [seq, seq] mask.
+
+    ``q``, ``k`` and ``v`` are [seq, heads, head_dim]. Runs of consecutive segments with the
+    same length (same-size images) are stacked and attended in one batched call, so
+    only [length, length] scores per segment exist and memory grows linearly with the
+    number of images. ``eager`` uses matmul + fp32 softmax instead of SDPA.
+    """
+    lengths = (cu_seqlens[1:] - cu_seqlens[:-1]).tolist()
+    outputs = []
+    start = 0
+    i = 0
+    while i < len(lengths):
+        length = lengths[i]
+        n = 1
+        while i + n < len(lengths) and lengths[i + n] == length:
+            n += 1
+        end = start + n * length
+        # [n * length, heads, dim] -> [n, heads, length, dim]
+        q_, k_, v_ = (x[start:end].reshape(n, length, *x.shape[1:]).transpose(1, 2) for x in (q, k, v))
+        if eager:
+            attn_weights = torch.matmul(q_, k_.transpose(-1, -2)) / math.sqrt(q_.shape[-1])
+            attn_weights = F.softmax(attn_weights, dim=-1, dtype=torch.float32).to(q_.dtype)
+            out = torch.matmul(attn_weights, v_)
+        else:
+            out = F.scaled_dot_product_attention(q_, k_, v_, dropout_p=0.0)
+        outputs.append(out.transpose(1, 2).reshape(n * length, out.shape[1], out.shape[-1]))
+        start = end
+        i += n
+    return outputs[0] if len(outputs) == 1 else torch.cat(outputs, dim=0)
+
+
+@patch("vision_varlen_attention")
+def varlen_vision_attention_forward(self, hidden_states, cu_seqlens, rotary_pos_emb=None, position_embeddings=None):
+    """``VisionAttention``/``VisionSdpaAttention.forward`` with per-segment attention instead of a dense mask."""
+    seq_length = hidden_states.shape[0]
+    q, k, v = self.qkv(hidden_states).reshape(seq_length, 3, self.num_heads, -1).permute(1, 0, 2, 3).unbind(0)
+    if position_embeddings is None:
+        emb = torch.cat((rotary_pos_emb, rotary_pos_emb), dim=-1)
+        cos, sin = emb.cos(), emb.sin()
+    else:
+        cos, sin = position_embeddings
+    q, k = apply_rotary_pos_emb_vision(q, k, cos, sin)
+
+    attn_output = vision_varlen_attention(q, k, v, cu_seqlens, eager=VARLEN_CLASSES[type(self).__name__])
+    return self.proj(attn_output.reshape(seq_length, -1))
+
+
+def install_varlen_vision_attention(model):
+    """Bind the varlen forward to every dense-mask attention block of the vision tower.
+
+    ``VisionFlashAttention2`` is already varlen and keeps its own forward.
+    Returns the number of blocks patched.
+    """
+    patched = 0
+    for module in find_visual(model).modules():
+        if type(module).__name__ in VARLEN_CLASSES:
+            bind_forward(module, varlen_vision_attention_forward)
+            patched += 1
+    return patched
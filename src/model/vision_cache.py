@@ -0,0 +1,142 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def find_visual(model):
+    """Return the Qwen2-VL vision tower of ``model`` (plain, composite or PEFT wrapped)."""
+    candidates = [model, getattr(model, "model", None), getattr(getattr(model, "base_model", None), "model", None)]
+    for candidate in candidates:
+        visual = getattr(candidate, "visual", None)
+        if visual is not None:
+            return visual
+    raise AttributeError(f"{type(model).__name__} has no vision tower")
+
+
+class VisionFeatureCache:
+    """Merged visual embeddings keyed by a hash of the preprocessed pixels and grid_thw.
+
+    The memory tier is an LRU bounded by ``max_bytes``; when ``disk_dir`` is set,
+    every computed entry is also written there and misses fall back to it, so
+    features survive restarts.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_held = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(pixel_values, grid_thw):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(str((tuple(pixel_values.shape), str(pixel_values.dtype))).encode())
+        digest.update(grid_thw.detach().to("cpu", torch.int64).numpy().tobytes())
+        digest.update(pixel_values.detach().contiguous().cpu().view(torch.uint8).numpy().tobytes())
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pt")
+
+    def get(self, key, device):
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return features.to(device)
+
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            features = torch.load(self._disk_path(key), map_location=device)
+            with self._lock:
+                self.disk_hits += 1
+            self._remember(key, features)
+            return features
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, features):
+        self._remember(key, features)
+        if self.disk_dir and not os.path.exists(self._disk_path(key)):
+            tmp_path = self._disk_path(key) + ".tmp"
+            torch.save(features.detach().cpu(), tmp_path)
+            os.replace(tmp_path, self._disk_path(key))
+
+    def _remember(self, key, features):
+        size = features.numel() * features.element_size()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = features.detach()
+            self.bytes_held += size
+            while self.bytes_held > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes_held -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes_held": self.bytes_held,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def install_vision_cache(model, cache):
+    """Wrap the vision tower's forward so cached images skip the encoder.
+
+    Images are looked up one by one, so a batch that mixes seen and unseen images
+    only encodes the unseen ones.
+    """
+    visual = find_visual(model)
+    encode = visual.forward
+    merge_area = visual.spatial_merge_size ** 2
+
+    def cached_forward(hidden_states, grid_thw, **kwargs):
+        patch_counts = grid_thw.prod(-1).tolist()
+        pixel_chunks = torch.split(hidden_states, patch_counts)
+
+        features = [None] * len(patch_counts)
+        keys = []
+        for i, (chunk, grid) in enumerate(zip(pixel_chunks, grid_thw)):
+            keys.append(cache.key(chunk, grid))
+            features[i] = cache.get(keys[-1], hidden_states.device)
+
+        missing = [i for i, f in enumerate(features) if f is None]
+        if missing:
+            encoded = encode(
+                torch.cat([pixel_chunks[i] for i in missing]),
+                grid_thw=grid_thw[missing],
+                **kwargs,
+            )
+            encoded = torch.split(encoded, [patch_counts[i] // merge_area for i in missing])
+            for i, chunk in zip(missing, encoded):
+                features[i] = chunk
+                cache.put(keys[i], chunk)
+
+        return torch.cat(features)
+
+    visual.forward = cached_forward
+    return cache
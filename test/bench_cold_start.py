@@ -0,0 +1,85 @@
+"""Cold-start cost of the full-precision snapshot vs the pre-quantized checkpoint.
+
+Each load runs in a fresh subprocess so page cache aside, nothing is shared:
+time until ``ClaraPipeline`` is constructed, time until the first (warm-up)
+generation finishes, peak host RSS and peak CUDA memory. With several model
+paths, a second table compares each path's median time to ready and peak host
+RSS with the first one's.
+
+    python -m src.model.quantized_checkpoint --model-path /path/to/model_hf_cached --output /path/to/clara-bnb-4bit
+    python test/bench_cold_start.py --model-path /path/to/model_hf_cached --model-path /path/to/clara-bnb-4bit
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = r"""
+import json, resource, sys, time
+started = time.perf_counter()
+import torch
+from src.model.hf_model import ClaraPipeline
+imported = time.perf_counter()
+pipeline = ClaraPipeline(sys.argv[1], vision_cache_bytes=0)
+loaded = time.perf_counter()
+pipeline.warm_up()
+torch.cuda.synchronize()
+ready = time.perf_counter()
+print(json.dumps({
+    "format": pipeline.load_format,
+    "import_s": imported - started,
+    "load_s": loaded - imported,
+    "ready_s": ready - started,
+    "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "peak_cuda_mib": torch.cuda.max_memory_allocated() / 2**20,
+}))
+"""
+
+
+def measure(model_path):
+    root = os.path.join(os.path.dirname(__file__), "..")
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, model_path], cwd=root, capture_output=True, text=True, check=True
+    ).stdout
+    # unsloth prints banners; the result is the last line
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model-path", action="append", required=True, help="repeat to compare several")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    print("| model path | format | import (s) | load (s) | time to ready (s) | peak host RSS (MiB) | peak CUDA (MiB) |")
+    print("|---|---|---|---|---|---|---|")
+    medians = {}
+    for model_path in args.model_path:
+        runs = []
+        for _ in range(args.repeat):
+            r = measure(model_path)
+            runs.append(r)
+            print(
+                f"| {model_path} | {r['format']} | {r['import_s']:.1f} | {r['load_s']:.1f} | {r['ready_s']:.1f} "
+                f"| {r['peak_rss_mib']:.0f} | {r['peak_cuda_mib']:.0f} |"
+            )
+        medians[model_path] = {key: statistics.median(r[key] for r in runs) for key in ("ready_s", "peak_rss_mib")}
+
+    if len(medians) > 1:
+        reference, *others = args.model_path
+        ref = medians[reference]
+        print(f"\nmedian of {args.repeat} run(s), relative to {reference}")
+        print("| model path | time to ready (s) | vs reference | peak host RSS (MiB) | vs reference |")
+        print("|---|---|---|---|---|")
+        for model_path in [reference, *others]:
+            m = medians[model_path]
+            print(
+                f"| {model_path} | {m['ready_s']:.1f} | {m['ready_s'] / ref['ready_s'] - 1:+.0%} "
+                f"| {m['peak_rss_mib']:.0f} | {m['peak_rss_mib'] / ref['peak_rss_mib'] - 1:+.0%} |"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Eager vs torch.compile for the hot functions in unsloth_compiled_cache, with a regression gate.
+
+Each function runs with Qwen2-VL-7B shapes, hidden sizes scaled by ``--scale``
+so the suite fits a CPU: once eager (the undecorated function, with dynamo
+disabled so nested compiled helpers run eager too) and once compiled. Reported
+per function: compile overhead (first compiled call minus a steady call),
+median eager and compiled time, bytes allocated per call, and whether the two
+outputs agree.
+
+A function fails the run (exit status 1) when its compiled version is slower
+than eager by more than ``--threshold``, or when its compiled output drifts
+from eager; neither needs a baseline. Timings are machine-specific, so record a
+baseline on the machine that runs the check: later runs also fail when a
+function's compiled time grows by more than ``--threshold`` over it, or when
+the baseline was recorded with another configuration (re-record it with
+``--save-baseline``).
+
+    python test/bench_compiled_cache.py --save-baseline
+    python test/bench_compiled_cache.py                      # compare against test/compiled_cache_baseline.json
+    python test/bench_compiled_cache.py --scale 1 --dtype bfloat16 --threshold 0.15
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from unsloth_compiled_cache import unsloth_compiled_module_qwen2_vl as qwen2_vl  # noqa: E402
+from unsloth_compiled_cache.UnslothGRPOTrainer import selective_log_softmax  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "compiled_cache_baseline.json")
+# allowed difference between eager and compiled outputs, relative to the largest output value
+TOLERANCE = {torch.float32: 1e-4, torch.bfloat16: 2e-2, torch.float16: 2e-3}
+
+
+def scaled(size, scale, multiple=16):
+    return max(multiple, int(size * scale) // multiple * multiple)
+
+
+def build_cases(scale, tokens, patches, dtype):
+    """``(name, compiled function, args)`` with Qwen2-VL-7B shapes; hidden sizes scaled, head layout kept."""
+    randn = lambda *shape: torch.randn(*shape, dtype=dtype)  # noqa: E731
+    text_hidden, text_inter = scaled(3584, scale), scaled(18944, scale)
+    vision_dim, vision_inter = scaled(1280, scale), scaled(5120, scale)
+    vocab = scaled(152064, scale)
+
+    patch_embed = qwen2_vl.PatchEmbed(patch_size=14, temporal_patch_size=2, in_channels=3, embed_dim=vision_dim)
+    vision_mlp = qwen2_vl.VisionMlp(vision_dim, vision_inter, "quick_gelu")
+    text_mlp = qwen2_vl.Qwen2MLP(
+        SimpleNamespace(hidden_size=text_hidden, intermediate_size=text_inter, hidden_act="silu")
+    )
+    for module in (patch_embed, vision_mlp, text_mlp):
+        module.to(dtype).eval()
+
+    return [
+        ("apply_multimodal_rotary_pos_emb", qwen2_vl.apply_multimodal_rotary_pos_emb,
+         (randn(1, 28, tokens, 128), randn(1, 4, tokens, 128), randn(3, 1, tokens, 128), randn(3, 1, tokens, 128),
+          [16, 24, 24])),
+        ("apply_rotary_pos_emb_vision", qwen2_vl.apply_rotary_pos_emb_vision,
+         (randn(patches, 16, 80), randn(patches, 16, 80), randn(patches, 80), randn(patches, 80))),
+        ("PatchEmbed_forward", qwen2_vl.PatchEmbed_forward, (patch_embed, randn(patches, 3 * 2 * 14 * 14))),
+        ("VisionMlp_forward", qwen2_vl.VisionMlp_forward, (vision_mlp, randn(patches, vision_dim))),
+        ("Qwen2MLP_forward", qwen2_vl.Qwen2MLP_forward, (text_mlp, randn(1, tokens, text_hidden))),
+        ("repeat_kv", qwen2_vl.repeat_kv, (randn(1, 4, tokens, 128), 7)),
+        ("selective_log_softmax", selective_log_softmax,
+         (randn(1, tokens, vocab), torch.randint(0, vocab, (1, tokens)))),
+    ]
+
+
+def median_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def allocated_bytes(fn):
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    return sum(e.self_cpu_memory_usage for e in prof.key_averages() if e.self_cpu_memory_usage > 0)
+
+
+def relative_diff(expected, actual):
+    expected = expected if isinstance(expected, tuple) else (expected,)
+    actual = actual if isinstance(actual, tuple) else (actual,)
+    return max(
+        (x.float() - y.float()).abs().max().item() / max(x.float().abs().max().item(), 1e-6)
+        for x, y in zip(expected, actual)
+    )
+
+
+def measure(compiled, args, repeat):
+    eager = getattr(compiled, "_torchdynamo_orig_callable", compiled)
+
+    def run_eager():
+        with torch._dynamo.config.patch(disable=True):
+            return eager(*args)
+
+    run_compiled = lambda: compiled(*args)  # noqa: E731
+
+    with torch.no_grad():
+        expected = run_eager()
+        eager_s = median_time(run_eager, repeat)
+        eager_bytes = allocated_bytes(run_eager)
+
+        started = time.perf_counter()
+        actual = run_compiled()
+        first_s = time.perf_counter() - started
+        compiled_s = median_time(run_compiled, repeat)
+        compiled_bytes = allocated_bytes(run_compiled)
+
+    return {
+        "eager_ms": eager_s * 1000,
+        "compiled_ms": compiled_s * 1000,
+        "compile_overhead_s": first_s - compiled_s,
+        "eager_alloc_mib": eager_bytes / 2**20,
+        "compiled_alloc_mib": compiled_bytes / 2**20,
+        "rel_diff": relative_diff(expected, actual),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=0.25, help="fraction of the 7B hidden sizes")
+    parser.add_argument("--tokens", type=int, default=256, help="text sequence length")
+    parser.add_argument("--patches", type=int, default=1024, help="vision patches (default profile: 256 tokens x 4)")
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed compiled-time growth over eager and over baseline")
+    parser.add_argument("--only", help="comma-separated function names")
+    args = parser.parse_args()
+
+    dtype = getattr(torch, args.dtype)
+    torch.manual_seed(0)
+    cases = build_cases(args.scale, args.tokens, args.patches, dtype)
+    if args.only:
+        cases = [case for case in cases if case[0] in args.only.split(",")]
+
+    config = {"scale": args.scale, "tokens": args.tokens, "patches": args.patches, "dtype": args.dtype}
+    baseline = {}
+    if not args.save_baseline and os.path.isfile(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved["config"] != config:
+            sys.exit(f"baseline {args.baseline} was recorded with {saved['config']}, not {config}; "
+                     "re-record it with --save-baseline")
+        baseline = saved["results"]
+
+    print(f"cpu, {args.dtype}, scale {args.scale}, {args.tokens} tokens, {args.patches} patches, {args.repeat} runs")
+    print("| function | compile (s) | eager (ms) | compiled (ms) | speed-up | eager alloc (MiB) "
+          "| compiled alloc (MiB) | max rel diff | vs baseline |")
+    print("|---|---|---|---|---|---|---|---|---|")
+    results, regressions = {}, []
+    for name, fn, fn_args in cases:
+        r = results[name] = measure(fn, fn_args, args.repeat)
+        verdict = "-"
+        slowdown = r["compiled_ms"] / r["eager_ms"] - 1
+        if slowdown > args.threshold:
+            regressions.append(f"{name}: compiled {r['compiled_ms']:.2f} ms vs eager {r['eager_ms']:.2f} ms "
+                               f"({slowdown:+.0%})")
+        if name in baseline:
+            growth = r["compiled_ms"] / baseline[name]["compiled_ms"] - 1
+            verdict = f"{growth:+.0%}"
+            if growth > args.threshold:
+                regressions.append(f"{name}: compiled {r['compiled_ms']:.2f} ms vs baseline "
+                                   f"{baseline[name]['compiled_ms']:.2f} ms ({growth:+.0%})")
+                verdict += " REGRESSION"
+        if r["rel_diff"] > TOLERANCE[dtype]:
+            regressions.append(f"{name}: compiled output differs from eager by {r['rel_diff']:.1e} (relative)")
+        print(
+            f"| {name} | {r['compile_overhead_s']:.2f} | {r['eager_ms']:.3f} | {r['compiled_ms']:.3f} "
+            f"| {r['eager_ms'] / r['compiled_ms']:.2f}x | {r['eager_alloc_mib']:.1f} | {r['compiled_alloc_mib']:.1f} "
+            f"| {r['rel_diff']:.1e} | {verdict} |"
+        )
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    if regressions:
+        print("\n".join(["regressions:"] + regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
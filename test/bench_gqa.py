@@ -0,0 +1,146 @@
+"""Eager grouped-query attention: ``repeat_kv`` copies vs folding query heads onto shared K/V.
+
+Qwen2-VL-7B has 28 query heads and 4 key/value heads, so ``repeat_kv`` copies
+K and V seven times per layer per decode step. This times one decode step
+(one new token over a KV cache of each length) and one prefill on CPU, checks
+the two versions agree, and reports the K/V bytes each reads or writes, for:
+
+- Qwen2-VL attention blocks, the path Clara runs: the generated
+  ``Qwen2VLAttention_forward`` in ``unsloth_compiled_cache`` against the
+  ``grouped_attention_forward`` ``ClaraPipeline`` binds, on one
+  ``Qwen2VLAttention`` with 7B projections, rope and cache update included;
+- Qwen2 text attention alone: the generated ``eager_attention_forward``
+  against the grouped one from ``src/model/gqa_attention.py``.
+
+Everything runs eager; dynamo is disabled so the compiled ``repeat_kv`` does too.
+
+    python test/bench_gqa.py
+    python test/bench_gqa.py --kv-lengths 512,2048 --batch 4 --dtype bfloat16
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import torch
+from transformers import Qwen2VLConfig
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.model import gqa_attention  # noqa: E402
+from unsloth_compiled_cache import unsloth_compiled_module_qwen2 as qwen2  # noqa: E402
+from unsloth_compiled_cache import unsloth_compiled_module_qwen2_vl as qwen2_vl  # noqa: E402
+
+HEADS = 28
+KV_HEADS = 4
+HEAD_DIM = 128
+HIDDEN = HEADS * HEAD_DIM
+MROPE_SECTION = [16, 24, 24]
+
+
+class PrefilledCache:
+    """A KV cache holding ``kv_len - q_len`` past positions; ``update`` appends without keeping the new ones,
+    so every timed call sees the same length."""
+
+    def __init__(self, key, value):
+        self.key, self.value = key, value
+
+    def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+        return torch.cat([self.key, key_states], dim=2), torch.cat([self.value, value_states], dim=2)
+
+
+def timed(fn, repeat):
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.perf_counter() - started) / repeat
+
+
+def causal_mask(batch, q_len, kv_len, dtype):
+    mask = torch.zeros(batch, 1, q_len, kv_len, dtype=dtype)
+    if q_len > 1:
+        mask += torch.full((q_len, kv_len), torch.finfo(dtype).min, dtype=dtype).triu(kv_len - q_len + 1)
+    return mask
+
+
+def print_row(step, kv_len, expected, actual, repeated_s, grouped_s, kv_bytes, n_rep):
+    # repeat_kv: read K/V, write n_rep copies, read the copies in the two matmuls
+    repeated_traffic = kv_bytes * (1 + 2 * n_rep)
+    diff = (expected.float() - actual.float()).abs().max().item()
+    print(
+        f"| {step} | {kv_len} | {repeated_s * 1000:.2f} | {grouped_s * 1000:.2f} | {repeated_s / grouped_s:.2f}x "
+        f"| {repeated_traffic / 2**20:.1f} | {kv_bytes / 2**20:.1f} | {diff:.1e} |"
+    )
+
+
+def bench_vl_block(cases, batch, dtype, repeat):
+    """Clara's path: one Qwen2-VL attention block, generated forward vs the bound grouped forward."""
+    config = Qwen2VLConfig(
+        hidden_size=HIDDEN, num_attention_heads=HEADS, num_key_value_heads=KV_HEADS,
+        rope_scaling={"type": "mrope", "mrope_section": MROPE_SECTION},
+    )
+    attention = qwen2_vl.Qwen2VLAttention(config, layer_idx=0).to(dtype).eval()
+    for step, q_len, kv_len in cases:
+        hidden = torch.randn(batch, q_len, HIDDEN, dtype=dtype)
+        cos, sin = (torch.randn(3, batch, q_len, HEAD_DIM, dtype=dtype) for _ in range(2))
+        past = (torch.randn(batch, KV_HEADS, kv_len - q_len, HEAD_DIM, dtype=dtype) for _ in range(2))
+        kwargs = dict(
+            attention_mask=causal_mask(batch, q_len, kv_len, dtype),
+            past_key_value=PrefilledCache(*past),
+            position_embeddings=(cos, sin),
+        )
+        repeated = lambda: qwen2_vl.Qwen2VLAttention_forward(attention, hidden, **kwargs)  # noqa: E731
+        grouped = lambda: gqa_attention.grouped_attention_forward(attention, hidden, **kwargs)  # noqa: E731
+        with torch.no_grad(), torch._dynamo.config.patch(disable=True):
+            (expected, *_), repeated_s = timed(repeated, repeat)
+            (actual, *_), grouped_s = timed(grouped, repeat)
+        kv_bytes = 2 * batch * KV_HEADS * kv_len * HEAD_DIM * torch.finfo(dtype).bits // 8
+        print_row(step, kv_len, expected, actual, repeated_s, grouped_s, kv_bytes, HEADS // KV_HEADS)
+
+
+def bench_eager_attention(cases, batch, dtype, repeat):
+    """Qwen2 text attention alone: the generated ``eager_attention_forward`` vs the grouped one."""
+    repeated = qwen2.eager_attention_forward._torchdynamo_orig_callable
+    grouped = gqa_attention.eager_attention_forward._torchdynamo_orig_callable
+    n_rep = HEADS // KV_HEADS
+    module = SimpleNamespace(num_key_value_groups=n_rep, training=False)
+    scaling = 1 / math.sqrt(HEAD_DIM)
+    for step, q_len, kv_len in cases:
+        query = torch.randn(batch, HEADS, q_len, HEAD_DIM, dtype=dtype)
+        key, value = (torch.randn(batch, KV_HEADS, kv_len, HEAD_DIM, dtype=dtype) for _ in range(2))
+        mask = causal_mask(batch, q_len, kv_len, dtype)
+        with torch.no_grad(), torch._dynamo.config.patch(disable=True):
+            (expected, _), repeated_s = timed(lambda: repeated(module, query, key, value, mask, scaling), repeat)
+            (actual, _), grouped_s = timed(lambda: grouped(module, query, key, value, mask, scaling), repeat)
+        kv_bytes = 2 * batch * KV_HEADS * kv_len * HEAD_DIM * torch.finfo(dtype).bits // 8
+        print_row(step, kv_len, expected, actual, repeated_s, grouped_s, kv_bytes, n_rep)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kv-lengths", default="256,512,1024")
+    parser.add_argument("--prefill", type=int, default=256, help="query length of the prefill row")
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    dtype = getattr(torch, args.dtype)
+    torch.manual_seed(0)
+    cases = [("decode", 1, int(n)) for n in args.kv_lengths.split(",")] + [("prefill", args.prefill, args.prefill)]
+    print(f"cpu, {args.dtype}, batch {args.batch}, {HEADS} query / {KV_HEADS} kv heads, {args.repeat} runs")
+    header = ("| step | kv length | repeat_kv (ms) | grouped (ms) | speed-up | K/V MiB repeat_kv "
+              "| K/V MiB grouped | max abs diff |\n|---|---|---|---|---|---|---|---|")
+    print("\nQwen2-VL attention block (Qwen2VLAttention_forward vs grouped_attention_forward)")
+    print(header)
+    bench_vl_block(cases, args.batch, dtype, args.repeat)
+    print("\nQwen2 eager_attention_forward")
+    print(header)
+    bench_eager_attention(cases, args.batch, dtype, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
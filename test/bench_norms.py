@@ -0,0 +1,95 @@
+"""The norm forwards that run after load vs the transformers/torch references, on CPU.
+
+For every dtype and hidden size (Qwen2-VL-7B text 3584, vision tower 1280),
+checks that each forward matches its reference within the dtype's tolerance
+and times both:
+
+- the generated ``Qwen2RMSNorm_forward`` against transformers' ``Qwen2RMSNorm``
+- ``rms_norm_forward``, which ``ClaraPipeline`` binds to ``nn.RMSNorm`` in place
+  of the generated ``RMSNorm.forward``, against ``torch.nn.RMSNorm``
+- the generated ``LayerNorm.forward`` against ``torch.nn.LayerNorm``
+
+Exits non-zero if any output mismatches.
+
+    python test/bench_norms.py
+    python test/bench_norms.py --tokens 1024 --dtypes bfloat16 --compiled
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+from torch import nn
+from transformers.models.qwen2.modeling_qwen2 import Qwen2RMSNorm
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.model.norms import rms_norm_forward  # noqa: E402
+from unsloth_compiled_cache import LayerNorm  # noqa: E402
+from unsloth_compiled_cache.unsloth_compiled_module_qwen2 import Qwen2RMSNorm_forward  # noqa: E402
+
+TOLERANCE = {torch.float32: 1e-5, torch.bfloat16: 1e-2, torch.float16: 1e-3}
+
+
+def timed(fn, repeat):
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.perf_counter() - started) / repeat
+
+
+def cases(hidden, dtype, qwen2_forward):
+    """``(name, reference module, forward run after load)``; weights are randomised so the weight term is tested."""
+    qwen2 = Qwen2RMSNorm(hidden, eps=1e-6)
+    rms = nn.RMSNorm(hidden, eps=1e-6, dtype=dtype)
+    layer = nn.LayerNorm(hidden, eps=1e-6, dtype=dtype)
+    with torch.no_grad():
+        for module in (qwen2, rms, layer):
+            module.weight.normal_(1.0, 0.1)
+        layer.bias.normal_(0.0, 0.1)
+    qwen2 = qwen2.to(dtype)
+    return [
+        ("Qwen2RMSNorm", qwen2, lambda x: qwen2_forward(qwen2, x)),
+        ("RMSNorm", rms, lambda x: rms_norm_forward(rms, x)),
+        ("LayerNorm", layer, lambda x: LayerNorm.forward(layer, x)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dtypes", default="float32,bfloat16,float16")
+    parser.add_argument("--hidden-sizes", default="1280,3584")
+    parser.add_argument("--tokens", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--compiled", action="store_true", help="time the torch.compile'd Qwen2RMSNorm_forward")
+    args = parser.parse_args()
+
+    # eager by default: torch.compile on CPU needs a C++ toolchain
+    qwen2_forward = Qwen2RMSNorm_forward if args.compiled else Qwen2RMSNorm_forward._torchdynamo_orig_callable
+
+    failures = 0
+    print(f"cpu, {args.tokens} tokens, {args.repeat} runs, {'compiled' if args.compiled else 'eager'}")
+    print("| norm | dtype | hidden | reference (us) | after load (us) | speed-up | max abs diff | ok |")
+    print("|---|---|---|---|---|---|---|---|")
+    for dtype in (getattr(torch, name) for name in args.dtypes.split(",")):
+        for hidden in (int(h) for h in args.hidden_sizes.split(",")):
+            x = torch.randn(1, args.tokens, hidden, dtype=dtype) * 3
+            for name, reference, loaded in cases(hidden, dtype, qwen2_forward):
+                with torch.no_grad():
+                    expected, reference_s = timed(lambda: reference(x), args.repeat)
+                    actual, loaded_s = timed(lambda: loaded(x), args.repeat)
+                diff = (expected.float() - actual.float()).abs().max().item()
+                ok = actual.dtype == expected.dtype and diff <= TOLERANCE[dtype] * expected.float().abs().max().item()
+                failures += not ok
+                print(
+                    f"| {name} | {str(dtype).replace('torch.', '')} | {hidden} | {reference_s * 1e6:.1f} "
+                    f"| {loaded_s * 1e6:.1f} | {reference_s / loaded_s:.2f}x | {diff:.1e} | {'yes' if ok else 'NO'} |"
+                )
+    if failures:
+        sys.exit(f"{failures} norm(s) differ from the reference")
+
+
+if __name__ == "__main__":
+    main()
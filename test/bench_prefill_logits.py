@@ -0,0 +1,51 @@
+"""Prefill with logits for every prompt position vs only the last one (``logits_to_keep=1``).
+
+For each resolution profile the image is resized by its policy and one prefill
+forward is timed both ways, with the peak CUDA memory it allocated. The full
+variant projects every prompt position through the 152k-entry ``lm_head``; the
+last-position variant is what ``generate`` and the continuous-batching backend
+now request.
+
+    python test/bench_prefill_logits.py --model-path /path/to/model --image examples/sample/test_1.png
+"""
+import argparse
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from prefill_timing import timed_prefill  # noqa: E402
+from src.model.resolution import PROFILES  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--image", default="examples/sample/test_1.png")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    from src.model.hf_model import ClaraPipeline
+
+    pipeline = ClaraPipeline(args.model_path, vision_cache_bytes=0)
+    source = Image.open(args.image).convert("RGB")
+    question = "Ảnh X-quang này có gì bất thường?"
+
+    print(f"image: {args.image} ({source.width}x{source.height}), {args.repeat} runs")
+    print("| profile | prompt tokens | all logits (ms) | last logits (ms) | all logits peak (MiB) | last logits peak (MiB) |")
+    print("|---|---|---|---|---|---|")
+    for name, policy in PROFILES.items():
+        image = policy.apply(source)
+        inputs = pipeline.prepare_inputs(pipeline.build_conversation(image, question), image).to("cuda")
+        full_s, full_peak = timed_prefill(pipeline.model, inputs, 0, args.repeat)
+        last_s, last_peak = timed_prefill(pipeline.model, inputs, 1, args.repeat)
+        print(
+            f"| {name} | {inputs.input_ids.shape[1]} | {full_s * 1000:.1f} | {last_s * 1000:.1f} "
+            f"| {full_peak / 2**20:.1f} | {last_peak / 2**20:.1f} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
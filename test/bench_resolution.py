@@ -0,0 +1,73 @@
+"""Prefill latency and GPU memory of Clara against the visual-token budget.
+
+For every resolution profile, the image is resized by the profile's policy and
+one prefill forward (the first-token cost of a request) is timed, with the peak
+CUDA memory it allocated.
+
+    python test/bench_resolution.py --model-path /path/to/model --image examples/sample/test_1.png
+    python test/bench_resolution.py --tokens-only   # visual-token table only, no model needed
+"""
+import argparse
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from prefill_timing import timed_prefill  # noqa: E402
+from src.model.resolution import PROFILES  # noqa: E402
+
+# typical archive sizes: the old fixed input, a square scan, portrait and landscape radiographs
+SIZES = [(448, 448), (1024, 1024), (2048, 2500), (3000, 2000)]
+
+
+def token_table():
+    print("| input size | " + " | ".join(f"{name} (size, tokens)" for name in PROFILES) + " |")
+    print("|---|" + "---|" * len(PROFILES))
+    for width, height in SIZES:
+        cells = []
+        for policy in PROFILES.values():
+            w, h = policy.target_size(width, height)
+            cells.append(f"{w}x{h}, {policy.visual_tokens(width, height)}")
+        print(f"| {width}x{height} | " + " | ".join(cells) + " |")
+
+
+def prefill_table(args):
+    from src.model.hf_model import ClaraPipeline
+
+    pipeline = ClaraPipeline(args.model_path, vision_cache_bytes=0)
+    source = Image.open(args.image).convert("RGB")
+    question = "Ảnh X-quang này có gì bất thường?"
+
+    print(f"image: {args.image} ({source.width}x{source.height}), {args.repeat} runs")
+    print("| profile | resized | visual tokens | prompt tokens | prefill (ms) | peak memory (MiB) |")
+    print("|---|---|---|---|---|---|")
+    for name, policy in PROFILES.items():
+        image = policy.apply(source)
+        conversation = pipeline.build_conversation(image, question)
+        inputs = pipeline.prepare_inputs(conversation, image).to("cuda")
+        elapsed, peak = timed_prefill(pipeline.model, inputs, 1, args.repeat)
+
+        print(
+            f"| {name} | {image.width}x{image.height} | {policy.visual_tokens(*source.size)} "
+            f"| {inputs.input_ids.shape[1]} | {elapsed * 1000:.1f} | {peak / 2**20:.1f} |"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model-path")
+    parser.add_argument("--image", default="examples/sample/test_1.png")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tokens-only", action="store_true")
+    args = parser.parse_args()
+
+    if args.tokens_only or not args.model_path:
+        token_table()
+    else:
+        prefill_table(args)
+
+
+if __name__ == "__main__":
+    main()
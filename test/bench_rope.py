@@ -0,0 +1,114 @@
+"""Rotary cos/sin per forward: recomputed (transformers) vs indexed from ``RopeTables``.
+
+Times the text rotary embedding for one decode step and for a prefill, and the
+vision tower's ``rot_pos_emb`` for one image grid per resolution profile, with
+Qwen2-VL-7B head shapes (text head_dim 128, vision head_dim 80) in a real
+Qwen2-VL module tree cut down to one layer. Runs on CPU; no checkpoint is
+needed. The max difference between cached and recomputed outputs is reported,
+and a forward through the text model must hit the cached tables, so a cache
+bound to a rotary embedding the model never calls fails the run.
+
+    python test/bench_rope.py
+    python test/bench_rope.py --device cuda --batch 4 --prefill 600
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+from transformers import Qwen2VLConfig, Qwen2VLForConditionalGeneration
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.model.resolution import PROFILES  # noqa: E402
+from src.model.rope_cache import RopeTables, find_text_rotary, install_rope_cache, text_rope_cached  # noqa: E402
+
+
+def build(device, max_positions):
+    # one layer of each is enough: the rotary embeddings only depend on the head sizes
+    config = Qwen2VLConfig(
+        vocab_size=256,
+        hidden_size=256,
+        intermediate_size=512,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        num_key_value_heads=1,
+        rope_scaling={"type": "mrope", "mrope_section": [16, 24, 24]},
+        vision_config={"depth": 1},
+    )
+    model = Qwen2VLForConditionalGeneration._from_config(config, attn_implementation="eager").to(device).eval()
+    rotary = find_text_rotary(model)
+    reference = (rotary.forward, model.visual.rot_pos_emb)
+    tables = install_rope_cache(model, RopeTables(max_positions=max_positions))
+    assert text_rope_cached(model), "the text rotary embedding was not wrapped"
+    return model, rotary, tables, reference
+
+
+def check_text_forward(model, tables, device):
+    """Run the text model once and require that its rotary embedding was served from ``tables``."""
+    hits = tables.stats()["text_hits"]
+    with torch.no_grad():
+        model(input_ids=torch.arange(8, device=device)[None])
+    if tables.stats()["text_hits"] == hits:
+        sys.exit("a text forward did not hit the rope tables: "
+                 "the cache wraps a rotary embedding the model never calls")
+
+
+def timed(fn, device, repeat):
+    fn()
+    if device == "cuda":
+        torch.cuda.synchronize()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return out, (time.perf_counter() - started) / repeat
+
+
+def row(name, reference, cached, device, repeat):
+    expected, reference_s = timed(reference, device, repeat)
+    actual, cached_s = timed(cached, device, repeat)
+    expected = expected if isinstance(expected, tuple) else (expected,)
+    actual = actual if isinstance(actual, tuple) else (actual,)
+    diff = max((a.float() - b.float()).abs().max().item() for a, b in zip(expected, actual))
+    print(
+        f"| {name} | {reference_s * 1e6:.1f} | {cached_s * 1e6:.1f} "
+        f"| {(reference_s - cached_s) * 1e6:.1f} | {diff:.1e} |"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--dtype", default="bfloat16")
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--prefill", type=int, default=300, help="prompt length")
+    parser.add_argument("--max-positions", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    model, rotary, tables, (text_reference, grid_reference) = build(args.device, args.max_positions)
+    check_text_forward(model, tables, args.device)
+    x = torch.zeros(1, device=args.device, dtype=getattr(torch, args.dtype))
+    decode_ids = torch.full((3, args.batch, 1), args.prefill, device=args.device)
+    prefill_ids = torch.arange(args.prefill, device=args.device).expand(3, args.batch, -1)
+
+    print(f"{args.device}, {args.dtype}, batch {args.batch}, {args.repeat} runs")
+    print("| call | recomputed (us) | cached (us) | saved per call (us) | max abs diff |")
+    print("|---|---|---|---|---|")
+    with torch.no_grad():
+        row("text, decode step", lambda: text_reference(x, decode_ids),
+            lambda: rotary(x, decode_ids), args.device, args.repeat)
+        row(f"text, prefill {args.prefill}", lambda: text_reference(x, prefill_ids),
+            lambda: rotary(x, prefill_ids), args.device, args.repeat)
+        for name, policy in PROFILES.items():
+            width, height = policy.target_size(1024, 1024)
+            grid = torch.tensor([[1, height // 14, width // 14]], device=args.device)
+            row(f"vision grid, {name} {width}x{height}", lambda: grid_reference(grid),
+                lambda: model.visual.rot_pos_emb(grid), args.device, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Multimodal position ids: transformers' ``get_rope_index`` vs the layout-cached version.
+
+Builds Clara-shaped prompts (template text, one image block, a question, and
+for the follow-up turn the first answer plus a second question), left-padded
+into batches, and checks the cached ``position_ids``/``rope_deltas`` are equal
+to the original's before timing both. Uses a one-layer Qwen2-VL config on CPU:
+``get_rope_index`` only reads token ids and grid sizes.
+
+    python test/bench_rope_index.py
+    python test/bench_rope_index.py --batch 8 --profile detail
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import torch
+from transformers import Qwen2VLConfig
+from transformers.models.qwen2_vl.modeling_qwen2_vl import Qwen2VLModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.model.resolution import PROFILES  # noqa: E402
+from src.model.rope_index import RopeIndexCache, install_rope_index_cache  # noqa: E402
+
+
+def build_model():
+    config = Qwen2VLConfig(
+        text_config={"hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 1,
+                     "num_attention_heads": 4, "num_key_value_heads": 2},
+        vision_config={"depth": 1, "embed_dim": 64, "hidden_size": 64, "num_heads": 4},
+    )
+    return Qwen2VLModel(config)
+
+
+def prompt(config, grid, question_len, answer_len, rng):
+    merge = config.vision_config.spatial_merge_size
+    t, h, w = grid
+    text = lambda n: [rng.randrange(1000, 50000) for _ in range(n)]  # noqa: E731
+    ids = text(14) + text(question_len)
+    ids += [config.vision_start_token_id] + [config.image_token_id] * (t * h * w // merge**2)
+    ids += [config.vision_end_token_id] + text(5)
+    if answer_len:
+        ids += text(answer_len) + text(30)
+    return ids
+
+
+def batch(config, grid, size, follow_up, rng):
+    rows = [prompt(config, grid, rng.randrange(10, 40), rng.randrange(100, 300) if follow_up else 0, rng)
+            for _ in range(size)]
+    length = max(len(r) for r in rows)
+    input_ids = torch.zeros(size, length, dtype=torch.long)
+    attention_mask = torch.zeros(size, length, dtype=torch.long)
+    for i, row in enumerate(rows):
+        input_ids[i, length - len(row):] = torch.tensor(row)
+        attention_mask[i, length - len(row):] = 1
+    return input_ids, torch.tensor([grid] * size), attention_mask
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--profile", default="default", choices=list(PROFILES))
+    parser.add_argument("--layouts", type=int, default=4, help="distinct prompts (question lengths) to cycle through")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    model = build_model()
+    reference = model.get_rope_index
+    cache = install_rope_index_cache(model, RopeIndexCache())
+    width, height = PROFILES[args.profile].target_size(1024, 1024)
+    grid = (1, height // 14, width // 14)
+
+    print(f"profile {args.profile} ({width}x{height}), batch {args.batch}, {args.repeat} runs")
+    print("| prompt | tokens | transformers (ms) | cached (ms) | identical |")
+    print("|---|---|---|---|---|")
+    for name, follow_up in (("first turn", False), ("follow-up", True)):
+        rng = random.Random(0)
+        inputs = [batch(model.config, grid, args.batch, follow_up, rng) for _ in range(args.layouts)]
+        expected = [reference(ids, thw, None, mask) for ids, thw, mask in inputs]
+        same = all(
+            torch.equal(a[0], b[0]) and torch.equal(a[1], b[1])
+            for a, b in zip(expected, (model.get_rope_index(ids, thw, None, mask) for ids, thw, mask in inputs))
+        )
+        cycle = iter(inputs * args.repeat)
+        _, reference_s = timed(lambda: reference(*_args(next(cycle))), args.repeat)
+        cycle = iter(inputs * args.repeat)
+        _, cached_s = timed(lambda: model.get_rope_index(*_args(next(cycle))), args.repeat)
+        print(
+            f"| {name} | {inputs[0][0].shape[1]} | {reference_s * 1000:.2f} | {cached_s * 1000:.2f} "
+            f"| {'yes' if same else 'NO'} |"
+        )
+    print(f"cache: {cache.stats()}")
+
+
+def _args(inputs):
+    input_ids, grid_thw, attention_mask = inputs
+    return input_ids, grid_thw, None, attention_mask
+
+
+if __name__ == "__main__":
+    main()
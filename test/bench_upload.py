@@ -0,0 +1,135 @@
+"""Compare request-parse cost of the base64 JSON /predict body and the binary upload body.
+
+Runs the server-side parsing of each path (no network): time to get from raw
+request bytes to a decoded PIL image, and how much the process's peak RSS
+grows on the way. Each path is measured in its own subprocess with
+``resource.getrusage``, so PIL's C-side buffers are counted and one path's
+high-water mark does not hide the other's. The request bodies are written by
+another subprocess: Linux carries the peak RSS across ``exec``, so the parent
+never holds them.
+
+    python test/bench_upload.py --image examples/sample/test_1.png --repeat 50
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+try:
+    from pydantic import BaseModel
+
+    class PredictionRequest(BaseModel):
+        images: str
+        text: str
+        model_name: str
+except ImportError:  # fall back to plain json parsing
+    PredictionRequest = None
+
+
+CHUNK_SIZE = 64 * 1024  # starlette hands the body over in chunks of this order
+SPOOL_BYTES = 1024 * 1024  # UPLOAD_SPOOL_BYTES in src/api/main_api.py
+
+
+def base64_body(image_bytes):
+    payload = {
+        "images": base64.b64encode(image_bytes).decode("utf-8"),
+        "text": "Ảnh X-quang này có gì bất thường?",
+        "model_name": "clara",
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def parse_base64(body):
+    data = json.loads(body)
+    if PredictionRequest is not None:
+        data = PredictionRequest(**data).model_dump()
+    image_bytes = base64.b64decode(data["images"])
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    return image
+
+
+def parse_binary(body):
+    # as read_image_body: chunks spooled to a SpooledTemporaryFile, decoded by PIL in place
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    for i in range(0, len(body), CHUNK_SIZE):
+        spooled.write(body[i:i + CHUNK_SIZE])
+    spooled.seek(0)
+    image = Image.open(spooled)
+    image.load()
+    return image
+
+
+PATHS = {"base64": ("base64 JSON", parse_base64), "binary": ("binary upload", parse_binary)}
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # ru_maxrss is in KiB on Linux
+
+
+def child(path, body_file, repeat):
+    """Parse ``body_file`` with ``path`` in this fresh process; prints its timing and peak RSS growth."""
+    with open(body_file, "rb") as f:
+        body = f.read()
+    fn = PATHS[path][1]
+    before = peak_rss()
+    fn(body)
+    grown = peak_rss() - before
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(body)
+    print(json.dumps({"elapsed": (time.perf_counter() - started) / repeat, "peak_rss_growth": grown}))
+
+
+def prepare(image_path, body_dir):
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+    for path, body in (("base64", base64_body(image_bytes)), ("binary", image_bytes)):
+        with open(os.path.join(body_dir, path), "wb") as f:
+            f.write(body)
+
+
+def run_child(*args):
+    return subprocess.run([sys.executable, __file__, *args], check=True, capture_output=True, text=True).stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", default="examples/sample/test_1.png")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--prepare", help=argparse.SUPPRESS)
+    parser.add_argument("--child", choices=list(PATHS), help=argparse.SUPPRESS)
+    parser.add_argument("--body", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.prepare:
+        return prepare(args.image, args.prepare)
+    if args.child:
+        return child(args.child, args.body, args.repeat)
+
+    print(f"image: {args.image} ({os.path.getsize(args.image) / 1024:.1f} KiB), {args.repeat} runs, "
+          "one process per path")
+    print("| path | payload (KiB) | parse time (ms) | peak RSS growth (KiB) |")
+    print("|---|---|---|---|")
+    with tempfile.TemporaryDirectory() as body_dir:
+        run_child("--prepare", body_dir, "--image", args.image)
+        for path, (name, _) in PATHS.items():
+            body_file = os.path.join(body_dir, path)
+            output = run_child("--child", path, "--body", body_file, "--repeat", str(args.repeat))
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"| {name} | {os.path.getsize(body_file) / 1024:.1f} | {result['elapsed'] * 1000:.2f} "
+                f"| {result['peak_rss_growth'] / 1024:.1f} |"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Vision-tower attention: the generated dense-mask forward vs the varlen runtime patch.
+
+Builds a Qwen2-VL vision attention block (embed_dim 1280, 16 heads) from
+``unsloth_compiled_cache`` and runs it on 1..N same-size images (patches per
+image from the resolution profile): once with its generated forward, which
+masks one [seq, seq] attention, and once with ``varlen_vision_attention_forward``
+bound the way ``ClaraPipeline`` binds it after load. Both outputs must match.
+Peak memory is measured on CUDA; on CPU the attention score/mask bytes each
+path materialises are reported instead.
+
+    python test/bench_vision_attention.py --images 1,2,4,8 --profile default
+    python test/bench_vision_attention.py --device cuda --eager
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.model.patching import bind_forward  # noqa: E402
+from src.model.resolution import PROFILES  # noqa: E402
+from src.model.vision_attention import varlen_vision_attention_forward  # noqa: E402
+from unsloth_compiled_cache import unsloth_compiled_module_qwen2_vl as qwen2_vl  # noqa: E402
+
+HEADS = 16
+DIM = 1280
+HEAD_DIM = DIM // HEADS
+
+
+def measure(fn, device, repeat):
+    fn()  # warm-up
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    if device == "cuda":
+        torch.cuda.synchronize()
+    elapsed = (time.perf_counter() - started) / repeat
+    peak = torch.cuda.max_memory_allocated() - baseline if device == "cuda" else None
+    return out, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", default="1,2,4,8")
+    parser.add_argument("--profile", default="default", choices=list(PROFILES))
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--eager", action="store_true", help="matmul + softmax path (VisionAttention) instead of SDPA")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    dtype = torch.bfloat16 if args.device == "cuda" else torch.float32
+    # 14x14 patches per image: 4 patches per visual token
+    patches = PROFILES[args.profile].visual_tokens(1024, 1024) * 4
+    print(f"{args.device}, {dtype}, {patches} patches per image, {'eager' if args.eager else 'sdpa'}")
+    memory = "peak memory (MiB)" if args.device == "cuda" else "scores + mask (MiB)"
+    print(f"| images | patches | dense (ms) | varlen (ms) | dense {memory} | varlen {memory} | max abs diff |")
+    print("|---|---|---|---|---|---|---|")
+    block_class = qwen2_vl.VisionAttention if args.eager else qwen2_vl.VisionSdpaAttention
+    dense_block = block_class(DIM, num_heads=HEADS).to(args.device, dtype).eval()
+    varlen_block = copy.deepcopy(dense_block)
+    bind_forward(varlen_block, varlen_vision_attention_forward)
+    for n in (int(x) for x in args.images.split(",")):
+        seq = n * patches
+        hidden = torch.randn(seq, DIM, device=args.device, dtype=dtype)
+        angles = torch.randn(seq, HEAD_DIM, device=args.device, dtype=torch.float32)
+        position_embeddings = (angles.cos(), angles.sin())
+        cu_seqlens = torch.arange(0, seq + 1, patches, device=args.device, dtype=torch.int32)
+
+        with torch.no_grad():
+            dense, dense_s, dense_peak = measure(
+                lambda: dense_block(hidden, cu_seqlens, position_embeddings=position_embeddings),
+                args.device, args.repeat,
+            )
+            varlen, varlen_s, varlen_peak = measure(
+                lambda: varlen_block(hidden, cu_seqlens, position_embeddings=position_embeddings),
+                args.device, args.repeat,
+            )
+        if dense_peak is None:
+            size = torch.finfo(dtype).bits // 8
+            dense_peak = HEADS * seq * seq * size + seq * seq * (size if args.eager else 1)
+            varlen_peak = HEADS * n * patches * patches * size
+        diff = (dense.float() - varlen.float()).abs().max().item()
+        print(
+            f"| {n} | {seq} | {dense_s * 1000:.1f} | {varlen_s * 1000:.1f} "
+            f"| {dense_peak / 2**20:.1f} | {varlen_peak / 2**20:.1f} | {diff:.2e} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
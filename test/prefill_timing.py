@@ -0,0 +1,21 @@
+"""Prefill timing shared by the benches that load Clara (bench_resolution, bench_prefill_logits)."""
+import time
+
+
+def timed_prefill(model, inputs, logits_to_keep=1, repeat=5):
+    """Mean seconds per prefill forward of ``inputs`` and the peak CUDA memory it allocated, in bytes.
+
+    One untimed forward runs first, so compilation for this shape is not counted.
+    """
+    import torch
+
+    with torch.no_grad():
+        model(**inputs, logits_to_keep=logits_to_keep)
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            model(**inputs, logits_to_keep=logits_to_keep)
+        torch.cuda.synchronize()
+    return (time.perf_counter() - started) / repeat, torch.cuda.max_memory_allocated() - baseline
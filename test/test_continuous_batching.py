@@ -0,0 +1,162 @@
+"""ContinuousBatchingEngine against ``model.generate`` on a tiny random Qwen2-VL, on CPU.
+
+Requests with different image grids (so different rope deltas) and token
+budgets go through fewer slots than requests, each one submitted as soon as
+the previous one has produced its first token. Each request's tokens must
+equal greedy ``generate`` for that request alone. One request is ended by EOS,
+one by its budget, and every slot is freed and reused. Closing the engine
+fails the requests it has not finished.
+
+    python -m pytest test/test_continuous_batching.py
+"""
+import os
+import sys
+import time
+
+import pytest
+import torch
+from transformers import BatchFeature, Qwen2VLConfig, Qwen2VLForConditionalGeneration
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.model.continuous_batching import ContinuousBatchingEngine  # noqa: E402
+from src.model.last_logits import install_last_logits  # noqa: E402
+from src.model.rope_index import find_rope_index_owner  # noqa: E402
+
+VISION_START, VISION_END, IMAGE_TOKEN = 3, 4, 5
+# (image grid t/h/w, text tokens after the image, token budget)
+REQUESTS = [((1, 4, 4), 6, 12), ((1, 4, 8), 3, 6), ((1, 8, 4), 9, 10), ((1, 8, 8), 4, 8)]
+
+
+class IdProcessor:
+    """Stands in for the processor: the engine only needs ``eos_token_id`` and ``batch_decode``."""
+
+    eos_token_id = None
+
+    def batch_decode(self, sequences, **kwargs):
+        return [" ".join(map(str, ids)) for ids in sequences]
+
+
+def tiny_model():
+    config = Qwen2VLConfig(
+        vocab_size=128,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=512,
+        rope_scaling={"type": "mrope", "mrope_section": [2, 3, 3]},
+        vision_config={
+            "depth": 1,
+            "embed_dim": 32,
+            "hidden_size": 64,
+            "mlp_ratio": 2,
+            "num_heads": 2,
+            "in_channels": 3,
+            "patch_size": 2,
+            "spatial_merge_size": 2,
+            "temporal_patch_size": 2,
+        },
+        vision_start_token_id=VISION_START,
+        vision_end_token_id=VISION_END,
+        image_token_id=IMAGE_TOKEN,
+        video_token_id=6,
+    )
+    torch.manual_seed(0)
+    model = Qwen2VLForConditionalGeneration._from_config(config, attn_implementation="eager").eval()
+    model.generation_config.pad_token_id = 0
+    model.generation_config.eos_token_id = None
+    install_last_logits(model)  # as ClaraPipeline does after load
+    return model
+
+
+def prompt(grid, text_tokens, seed):
+    generator = torch.Generator().manual_seed(seed)
+    t, h, w = grid
+    image_tokens = t * h * w // 4  # 2x2 patches merge into one token
+    text = lambda n: torch.randint(7, 128, (n,), generator=generator).tolist()  # noqa: E731
+    input_ids = text(3) + [VISION_START] + [IMAGE_TOKEN] * image_tokens + [VISION_END] + text(text_tokens)
+    return BatchFeature({
+        "input_ids": torch.tensor([input_ids]),
+        "attention_mask": torch.ones(1, len(input_ids), dtype=torch.long),
+        "pixel_values": torch.randn(t * h * w, 3 * 2 * 2 * 2, generator=generator),
+        "image_grid_thw": torch.tensor([grid]),
+    })
+
+
+def greedy(model, inputs, max_new_tokens):
+    with torch.no_grad():
+        output = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+    return output[0, inputs["input_ids"].shape[1]:].tolist()
+
+
+def test_staggered_requests_match_generate():
+    model = tiny_model()
+    prompts = [prompt(grid, text_tokens, seed) for seed, (grid, text_tokens, _) in enumerate(REQUESTS)]
+    budgets = [budget for _, _, budget in REQUESTS]
+
+    # pick an EOS that request 0 emits before its budget but request 1 never does,
+    # so one request is evicted by EOS and another by its budget
+    unbounded = [greedy(model, inputs, budget) for inputs, budget in zip(prompts, budgets)]
+    eos = next((token for token in unbounded[0][:-1] if token not in unbounded[1]), None)
+    assert eos is not None, "no token separates request 0 from request 1; change the seeds"
+    model.generation_config.eos_token_id = eos
+    expected = [greedy(model, inputs, budget) for inputs, budget in zip(prompts, budgets)]
+    assert expected[0][-1] == eos and len(expected[0]) < budgets[0]
+    assert eos not in expected[1] and len(expected[1]) == budgets[1]
+
+    get_rope_index = find_rope_index_owner(model).get_rope_index
+    deltas = [get_rope_index(inputs["input_ids"], inputs["image_grid_thw"])[1].item() for inputs in prompts]
+    assert len(set(deltas)) > 1, "requests should have different rope deltas"
+
+    engine = ContinuousBatchingEngine(model, IdProcessor(), max_slots=2, max_len=256)
+    requests = {}
+
+    def submit(i):
+        first = [True]
+
+        def on_token(token):
+            # runs on the engine thread: the next request arrives while this one is decoding
+            if first[0] and i + 1 < len(prompts):
+                first[0] = False
+                submit(i + 1)
+
+        requests[i] = engine.submit(prompts[i], max_new_tokens=budgets[i], on_token=on_token)
+
+    try:
+        submit(0)
+        deadline = time.monotonic() + 60
+        while len(requests) < len(prompts) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(requests) == len(prompts), "not every request was submitted"
+        for i in range(len(prompts)):
+            requests[i].future.result(timeout=60)
+    finally:
+        engine.close(timeout=5)
+
+    for i, tokens in enumerate(expected):
+        assert requests[i].generated == tokens, f"request {i} diverged from generate"
+        assert requests[i].rope_delta == deltas[i]
+    stats = engine.stats()
+    # four requests through two slots: every eviction freed its slot for a later admission
+    assert stats["prefills"] == stats["completed"] == len(prompts)
+    assert stats["free_slots"] == 2 and stats["running"] == 0
+    # request 1 (no EOS, budget 6) was still decoding when request 2 joined
+    assert stats["avg_running_batch"] > 1
+
+
+def test_close_fails_unfinished_requests():
+    model = tiny_model()
+    engine = ContinuousBatchingEngine(model, IdProcessor(), max_slots=1, max_len=256)
+    requests = [
+        engine.submit(prompt(grid, text_tokens, seed), max_new_tokens=budget)
+        for seed, (grid, text_tokens, budget) in enumerate(REQUESTS)
+    ]
+    engine.close(timeout=60)
+
+    # one slot: the engine stops long before the last request is admitted
+    assert all(request.future.done() for request in requests)
+    assert isinstance(requests[-1].future.exception(), RuntimeError)
+    with pytest.raises(RuntimeError):
+        engine.submit(prompt(*REQUESTS[0][:2], seed=0))
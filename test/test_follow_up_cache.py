@@ -0,0 +1,196 @@
+"""ClaraPipeline's follow-up turn on the turn-1 KV cache vs re-templating the whole conversation.
+
+A tiny random Qwen2-VL runs ``ClaraPipeline.run`` on CPU with
+``reuse_kv_cache`` on and off; both reports must match token for token under
+greedy decoding, whether turn 1 ends with EOS or is cut at ``max_tokens``, and
+also when another prompt ran on the model between the two turns. The processor
+is a character-level stand-in with Qwen2-VL's chat template, so decoding a
+response and tokenizing it again gives back the same ids, which is what the
+re-templated path relies on.
+
+    python -m pytest test/test_follow_up_cache.py
+"""
+import os
+import re
+import string
+import sys
+import types
+
+import pytest
+import torch
+from PIL import Image
+from transformers import BatchFeature, Qwen2VLConfig, Qwen2VLForConditionalGeneration
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# ClaraPipeline is assembled around a tiny model below and never loads through
+# unsloth, which only imports on a CUDA machine.
+sys.modules.setdefault("unsloth", types.SimpleNamespace(FastLanguageModel=None))
+
+from src.model.hf_model import FOLLOW_UP_QUESTION, ClaraPipeline  # noqa: E402
+from src.model.last_logits import install_last_logits  # noqa: E402
+from src.model.rope_index import find_rope_index_owner  # noqa: E402
+
+SPECIAL = ["<|endoftext|>", "<|im_start|>", "<|im_end|>", "<|vision_start|>", "<|vision_end|>",
+           "<|image_pad|>", "<|video_pad|>"]
+QUESTION = "Mô tả ảnh X-quang này."
+CHARS = sorted(set(string.printable) | set(FOLLOW_UP_QUESTION) | set(QUESTION))
+PATCH = 7  # pixels per patch side, so a 56x56 image is an 8x8 grid merged into 16 image tokens
+
+
+class CharTokenizer:
+    """One id per special token and per character."""
+
+    def __init__(self):
+        self.vocab = SPECIAL + CHARS
+        self.ids = {token: i for i, token in enumerate(self.vocab)}
+        self.eos_token_id = self.ids["<|im_end|>"]
+        self._split = re.compile("(" + "|".join(map(re.escape, SPECIAL)) + ")")
+
+    def encode(self, text):
+        ids = []
+        for piece in self._split.split(text):
+            ids.extend([self.ids[piece]] if piece in SPECIAL else [self.ids[c] for c in piece])
+        return ids
+
+    def __call__(self, text, add_special_tokens=False, return_tensors="pt"):
+        return BatchFeature({"input_ids": torch.tensor([self.encode(text)])})
+
+    def decode(self, ids, skip_special_tokens=False, **kwargs):
+        tokens = (self.vocab[int(i)] for i in ids)
+        return "".join(t for t in tokens if not (skip_special_tokens and t in SPECIAL))
+
+    def batch_decode(self, sequences, **kwargs):
+        return [self.decode(ids, **kwargs) for ids in sequences]
+
+
+class CharProcessor(CharTokenizer):
+    """Qwen2-VL's chat template and image placeholder expansion over ``CharTokenizer``."""
+
+    image_token = "<|image_pad|>"
+
+    def __init__(self):
+        super().__init__()
+        self.tokenizer = CharTokenizer()
+
+    def apply_chat_template(self, conversation, tokenize=False, add_generation_prompt=True):
+        text = ""
+        for message in conversation:
+            text += f"<|im_start|>{message['role']}\n"
+            for part in message["content"]:
+                text += "<|vision_start|><|image_pad|><|vision_end|>" if part["type"] == "image" else part["text"]
+            text += "<|im_end|>\n"
+        return text + ("<|im_start|>assistant\n" if add_generation_prompt else "")
+
+    def __call__(self, image, text, add_special_tokens=False, return_tensors="pt"):
+        t, h, w = 1, image.height // PATCH, image.width // PATCH
+        text = text.replace(self.image_token, self.image_token * (t * h * w // 4), 1)
+        input_ids = torch.tensor([self.encode(text)])
+        # pixels derived from the image, so both paths see the same patches
+        generator = torch.Generator().manual_seed(sum(image.getpixel((0, 0))))
+        return BatchFeature({
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "pixel_values": torch.randn(t * h * w, 3 * 2 * 2 * 2, generator=generator),
+            "image_grid_thw": torch.tensor([[t, h, w]]),
+        })
+
+
+def tiny_pipeline(processor, max_tokens):
+    config = Qwen2VLConfig(
+        vocab_size=len(processor.vocab),
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=1024,
+        tie_word_embeddings=False,
+        rope_scaling={"type": "mrope", "mrope_section": [2, 3, 3]},
+        vision_config={
+            "depth": 1,
+            "embed_dim": 32,
+            "hidden_size": 64,
+            "mlp_ratio": 2,
+            "num_heads": 2,
+            "in_channels": 3,
+            "patch_size": 2,
+            "spatial_merge_size": 2,
+            "temporal_patch_size": 2,
+        },
+        vision_start_token_id=processor.ids["<|vision_start|>"],
+        vision_end_token_id=processor.ids["<|vision_end|>"],
+        image_token_id=processor.ids["<|image_pad|>"],
+        video_token_id=processor.ids["<|video_pad|>"],
+    )
+    torch.manual_seed(0)
+    model = Qwen2VLForConditionalGeneration._from_config(config, attn_implementation="eager").eval()
+    model.generation_config.do_sample = False
+    model.generation_config.eos_token_id = processor.eos_token_id
+    model.generation_config.pad_token_id = processor.ids["<|endoftext|>"]
+    # responses are plain text, as with the real model, so they survive decode + re-tokenize
+    model.generation_config.suppress_tokens = [i for i, token in enumerate(SPECIAL) if token != "<|im_end|>"]
+    install_last_logits(model)
+
+    # only what run() uses; __init__ would load a checkpoint through unsloth
+    pipeline = ClaraPipeline.__new__(ClaraPipeline)
+    pipeline.model = model
+    pipeline.tokenizer = processor
+    pipeline.max_tokens = max_tokens
+    pipeline.max_seq_length = 1024
+    pipeline.rope_index_owner = find_rope_index_owner(model)
+    return pipeline
+
+
+def run(pipeline, image, reuse_kv_cache, between=None):
+    pipeline.reuse_kv_cache = reuse_kv_cache
+    events = []
+    on_event = lambda kind, payload: events.append((kind, payload))  # noqa: E731
+    if between is not None:
+        # another prompt prefills on the same model right after turn 1
+        generate_response = pipeline._generate_response
+
+        def interleaved(*args, **kwargs):
+            result = generate_response(*args, **kwargs)
+            if kwargs.get("return_state"):
+                with torch.no_grad():
+                    generate_response(pipeline.build_conversation(between, "?"), between, on_event=on_event)
+            return result
+
+        pipeline._generate_response = interleaved
+    try:
+        with torch.no_grad():
+            return pipeline.run(image, QUESTION, on_event=on_event)
+    finally:
+        pipeline.__dict__.pop("_generate_response", None)
+
+
+def turn_1_tokens(pipeline, image):
+    inputs = pipeline.prepare_inputs(pipeline.build_conversation(image, QUESTION), image)
+    with torch.no_grad():
+        sequences = pipeline.model.generate(**inputs, max_new_tokens=pipeline.max_tokens)
+    return sequences[0, inputs["input_ids"].shape[1]:].tolist()
+
+
+@pytest.mark.parametrize("turn_1_end", ["eos", "max_tokens"])
+def test_follow_up_on_cache_matches_retemplated(turn_1_end):
+    processor = CharProcessor()
+    pipeline = tiny_pipeline(processor, max_tokens=12)
+    image = Image.new("RGB", (56, 56), (10, 20, 30))
+
+    tokens = turn_1_tokens(pipeline, image)
+    if turn_1_end == "eos":
+        # make <|im_end|> outscore the token turn 1 emits third, so turn 1 stops there
+        with torch.no_grad():
+            weight = pipeline.model.lm_head.weight
+            weight[processor.eos_token_id] = weight[tokens[2]] * 1.5
+        tokens = turn_1_tokens(pipeline, image)
+        assert tokens[-1] == processor.eos_token_id and len(tokens) < pipeline.max_tokens
+    else:
+        assert processor.eos_token_id not in tokens and len(tokens) == pipeline.max_tokens
+
+    retemplated = run(pipeline, image, reuse_kv_cache=False)
+    assert run(pipeline, image, reuse_kv_cache=True) == retemplated
+    # an image of another shape between the turns leaves other rope_deltas on the model
+    other = Image.new("RGB", (28, 56), (200, 100, 50))
+    assert run(pipeline, image, reuse_kv_cache=True, between=other) == retemplated